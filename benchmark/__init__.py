@@ -0,0 +1,8 @@
+"""
+Benchmark package: synthetic workload generation (`workload.py`) and the benchmark runner (`run_benchmark.py`).
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
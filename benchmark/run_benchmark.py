@@ -0,0 +1,313 @@
+"""
+Script to benchmark the engine on synthetic workloads.
+
+Typical usage example (run from the project root):
+
+    python3 benchmark/run_benchmark.py --numOfTransactions 10000 --skew 1.0
+
+    # run the predefined suite
+    python3 benchmark/run_benchmark.py --suite --numOfTransactions 100000
+
+    # write the trace instead of running it, e.g. to replay it with main.py
+    python3 benchmark/run_benchmark.py --dumpTrace - | python3 src/main.py --testFile - --logLevel INFO
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from const import NUM_OF_SITES, NUM_OF_VARIABLES, ConcurrencyControl, DeadlockPolicy
+from data_mgr import DataMgr
+from main import parse_lines, run
+from metrics import Metrics
+from replica_selection import REPLICA_SELECTIONS, get_replica_selection
+from detection_trigger import DETECTION_TRIGGERS, get_detection_trigger
+from transaction_mgr import TransactionMgr
+from workload import generate_workload, write_workload
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# name -> workload parameters overriding the command line ones
+SUITE = {
+    "uniform": dict(skew=0.0, roFraction=0.0, failRate=0.0, recoverRate=0.0),
+    "hot": dict(skew=1.2, roFraction=0.0, failRate=0.0, recoverRate=0.0),
+    "read_only_heavy": dict(skew=0.8, roFraction=0.5, failRate=0.0, recoverRate=0.0),
+    "failures": dict(skew=0.8, roFraction=0.1, failRate=0.01, recoverRate=0.02),
+}
+
+class CountingIterator(object):
+    """ Wrap an iterator and count the items it yields. """
+    def __init__(self, iterable) -> None:
+        self.iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.iterator)
+        self.count += 1
+        return item
+
+def run_workload(params, numOfSites, numOfVariables, traceMemory=False, metrics=None, replicaSelection="first",
+                 deadlockPolicy="detection", detectionTrigger=None, concurrencyControl="locking"):
+    """
+    Run a generated workload through DataMgr, TransactionMgr and `run`.
+
+    Parameters
+    -----------
+    params: dict
+        Parameters of `generate_workload`
+    numOfSites: int
+        Number of sites
+    numOfVariables: int
+        Number of variables
+    traceMemory: bool
+        If the peak Python heap size is measured with tracemalloc (slows down the run)
+    metrics: Metrics object
+        Metrics to collect during the run; None to disable them
+    replicaSelection: str
+        Name of the replica selection policy for reads of replicated variables
+    deadlockPolicy: str
+        Deadlock detection or prevention policy, a DeadlockPolicy value
+    detectionTrigger: tuple
+        (name, value) of the detection trigger; onBlock if None
+    concurrencyControl: str
+        Locking or optimistic, a ConcurrencyControl value
+
+    Returns: dict
+    -----------
+    Operations, elapsed seconds, ops/sec, commits, aborts, memory peaks, reads per site 
+    and the largest number of committed versions each site kept at once during the run.
+    """
+    if traceMemory:
+        tracemalloc.start()
+
+    executions = CountingIterator(parse_lines(generate_workload(numOfSites=numOfSites, numOfVariables=numOfVariables, **params)))
+    start = time.perf_counter()
+    DM = DataMgr(numOfSites, numOfVariables, replicaSelection=get_replica_selection(replicaSelection))
+    TM = TransactionMgr(DM, deadlockPolicy=deadlockPolicy, concurrencyControl=concurrencyControl)
+    if metrics is not None:
+        TM.attach_metrics(metrics)
+    run(executions, DM, TM, get_detection_trigger(*detectionTrigger) if detectionTrigger is not None else None)
+    elapsed = time.perf_counter() - start
+    peakVersions = DM.get_retained_version_counts(peak=True)
+    if metrics is not None:
+        metrics.record_read_counts(DM.get_read_counts())
+        metrics.record_lock_table_sizes(DM.get_lock_table_sizes(peak=True))
+        metrics.record_version_counts(DM.get_retained_version_counts(), peakVersions)
+
+    report = {
+        "operations": executions.count,
+        "seconds": elapsed,
+        "opsPerSec": executions.count / elapsed if elapsed else float('inf'),
+        "commits": TM.numOfCommits,
+        "aborts": TM.numOfAborts,
+        "commitRatio": TM.numOfCommits / max(TM.numOfCommits + TM.numOfAborts, 1),
+        "peakHeapMB": None,
+        "peakRssMB": None,
+        "readsPerSite": DM.get_read_counts(),
+        "peakVersionsPerSite": peakVersions,
+    }
+    if traceMemory:
+        report["peakHeapMB"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        scale = 2**20 if sys.platform == "darwin" else 2**10
+        report["peakRssMB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return report
+
+def _init_subprocess(logLevel):
+    logging.basicConfig(level=logLevel)
+
+def _run_workload_in_subprocess(args, kwargs):
+    report = run_workload(*args, **kwargs)
+    # the caller only sees the subprocess's copy of the metrics through the return value
+    return report, kwargs.get("metrics")
+
+def run_isolated(*args, logLevel="CRITICAL", **kwargs):
+    """
+    Run `run_workload` in a new process, so that its peak RSS does not include the earlier runs,
+    ru_maxrss being the peak of the whole process.
+
+    Parameters
+    -----------
+    args, kwargs:
+        Arguments of `run_workload`
+    logLevel: str
+        Level of the engine's log messages printed to stderr by the subprocess
+
+    Returns: tuple
+    -----------
+    Report of the run, and the metrics collected by the subprocess (None if disabled).
+    """
+    # processes forked by the fork server start from its small footprint, while spawned ones
+    # inherit the peak RSS of this process (vfork + exec)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_subprocess, initargs=(logLevel,)) as executor:
+        return executor.submit(_run_workload_in_subprocess, args, kwargs).result()
+
+def measure_memory_per_transaction(params, numOfSites, numOfVariables, numOfTransactions=100):
+    """
+    Measure the Python heap used per live transaction: start a workload's transactions 
+    without ending them, and divide the heap growth by the number of transactions still active.
+
+    Parameters
+    -----------
+    params: dict
+        Parameters of `generate_workload`
+    numOfSites: int
+        Number of sites
+    numOfVariables: int
+        Number of variables
+    numOfTransactions: int
+        Number of transactions to start; all of them stay live, so deadlock detection cost grows quickly with it
+
+    Returns: float
+    -----------
+    Bytes per live transaction.
+    """
+    params = {**params, "numOfTransactions": numOfTransactions, "concurrency": numOfTransactions}
+    lines = [line for line in generate_workload(numOfSites=numOfSites, numOfVariables=numOfVariables, **params)
+             if not line.startswith("end(")]
+    executions = list(parse_lines(lines))
+
+    tracemalloc.start()
+    DM = DataMgr(numOfSites, numOfVariables)
+    TM = TransactionMgr(DM)
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(executions, DM, TM)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return used / max(len(TM.transactions), 1)
+
+def get_run_name(name, concurrencyControl, policy, numOfControls, numOfPolicies):
+    """ Name a run by its workload and the settings that vary between runs. """
+    parts = [name] if name is not None else []
+    if numOfControls > 1:
+        parts.append(concurrencyControl)
+    # the deadlock policy only matters with locking
+    if numOfPolicies > 1 and concurrencyControl == ConcurrencyControl.LOCKING.value:
+        parts.append(policy)
+    return "/".join(parts) or "workload"
+
+def format_report(name, report):
+    line = f"{name:<34} {report['operations']:>10} ops {report['seconds']:>8.2f}s {report['opsPerSec']:>10.0f} ops/sec " \
+           f"commits {report['commits']:>8} aborts {report['aborts']:>8} (commit ratio {report['commitRatio']:.3f})"
+    if report["peakHeapMB"] is not None:
+        line += f" peak heap {report['peakHeapMB']:.1f}MB"
+    if report["peakRssMB"] is not None:
+        line += f" peak RSS {report['peakRssMB']:.1f}MB"
+    if report.get("bytesPerTransaction") is not None:
+        line += f" {report['bytesPerTransaction']:.0f}B/transaction"
+    if report.get("peakVersionsPerSite"):
+        line += f" peak versions/site {max(report['peakVersionsPerSite'].values())}"
+    reads = list(report["readsPerSite"].values())
+    if sum(reads):
+        # how much more the busiest site reads than the average site
+        line += f" read imbalance {max(reads) * len(reads) / sum(reads):.2f}"
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the engine on synthetic workloads.')
+    parser.add_argument('--numOfTransactions', type=int, default=10000, help='Number of transactions.')
+    parser.add_argument('--opsPerTransaction', type=int, default=5, help='Number of reads and writes per transaction.')
+    parser.add_argument('--readRatio', type=float, default=0.5, help='Probability that an operation of a read write transaction is a read.')
+    parser.add_argument('--roFraction', type=float, default=0.1, help='Fraction of read only transactions.')
+    parser.add_argument('--skew', type=float, default=0.0, help='Zipf exponent of variable accesses; 0 for uniform.')
+    parser.add_argument('--failRate', type=float, default=0.0, help='Probability of failing a site at each step.')
+    parser.add_argument('--recoverRate', type=float, default=0.0, help='Probability of recovering a failed site at each step.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Maximum number of concurrent transactions.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--numOfSites', type=int, default=NUM_OF_SITES, help='Number of sites.')
+    parser.add_argument('--numOfVariables', type=int, default=NUM_OF_VARIABLES, help='Number of variables.')
+    parser.add_argument('--logLevel', type=str.upper, default="CRITICAL", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        help="Level of the engine's log messages printed to stderr.")
+    parser.add_argument('--suite', action='store_true', help='Run the predefined workloads instead of a single one.')
+    parser.add_argument('--traceMemory', action='store_true', help='Measure the peak Python heap size with tracemalloc.')
+    parser.add_argument('--metrics', type=str, default=None, help='Collect metrics of a single workload and write them to this JSON file.')
+    parser.add_argument('--replicaSelection', type=str, default="first", choices=list(REPLICA_SELECTIONS),
+                        help='Policy choosing the site to read a replicated variable from.')
+    parser.add_argument('--deadlockPolicy', type=str, default="detection", choices=[policy.value for policy in DeadlockPolicy] + ["all"],
+                        help="Deadlock detection or prevention policy; 'all' runs the workloads once with each of them.")
+    parser.add_argument('--detectionTrigger', type=str, default="onBlock", choices=list(DETECTION_TRIGGERS),
+                        help='When deadlock detection runs under the detection policy.')
+    parser.add_argument('--concurrencyControl', type=str, default="locking", choices=[cc.value for cc in ConcurrencyControl] + ["all"],
+                        help="Strict two phase locking or optimistic concurrency control (only reads are validated, the last blind write "
+                             "to commit wins); 'all' runs the workloads once with each of them.")
+    parser.add_argument('--detectionTriggerValue', type=int, default=None,
+                        help='Interval in ticks (periodic), wait list size (threshold) or timeout in ticks (timeout).')
+    parser.add_argument('--dumpTrace', type=str, default=None, help="Write the workload to this file ('-' for stdout) instead of running it.")
+    args = parser.parse_args()
+
+    # the engine's output is not needed here
+    logging.basicConfig(level=args.logLevel)
+
+    params = dict(numOfTransactions=args.numOfTransactions, opsPerTransaction=args.opsPerTransaction,
+                  readRatio=args.readRatio, roFraction=args.roFraction, skew=args.skew, failRate=args.failRate,
+                  recoverRate=args.recoverRate, concurrency=args.concurrency, seed=args.seed)
+
+    if args.dumpTrace is not None:
+        if args.dumpTrace == '-':
+            for line in generate_workload(numOfSites=args.numOfSites, numOfVariables=args.numOfVariables, **params):
+                sys.stdout.write(line + "\n")
+        else:
+            write_workload(args.dumpTrace, numOfSites=args.numOfSites, numOfVariables=args.numOfVariables, **params)
+        return
+
+    detectionTrigger = (args.detectionTrigger, args.detectionTriggerValue)
+    try:
+        get_detection_trigger(*detectionTrigger)
+    except ValueError as e:
+        parser.error(str(e))
+    policies = [policy.value for policy in DeadlockPolicy] if args.deadlockPolicy == "all" else [args.deadlockPolicy]
+    controls = [cc.value for cc in ConcurrencyControl] if args.concurrencyControl == "all" else [args.concurrencyControl]
+    # (concurrency control, deadlock policy) of each run, optimistic runs take no locks so need a single policy
+    runs = [(cc, policy) for cc in controls for policy in (policies if cc == ConcurrencyControl.LOCKING.value else policies[:1])]
+    if args.suite:
+        if args.metrics:
+            parser.error("--metrics collects a single workload and cannot be used with --suite")
+        for name, overrides in SUITE.items():
+            workloadParams = {**params, **overrides}
+            bytesPerTransaction = measure_memory_per_transaction(workloadParams, args.numOfSites, args.numOfVariables)
+            for cc, policy in runs:
+                report, _ = run_isolated(workloadParams, args.numOfSites, args.numOfVariables, args.traceMemory,
+                                         replicaSelection=args.replicaSelection, deadlockPolicy=policy,
+                                         detectionTrigger=detectionTrigger, concurrencyControl=cc, logLevel=args.logLevel)
+                report["bytesPerTransaction"] = bytesPerTransaction
+                print(format_report(get_run_name(name, cc, policy, len(controls), len(policies)), report))
+        return
+
+    if args.metrics and len(runs) > 1:
+        parser.error("--metrics needs a single --deadlockPolicy and --concurrencyControl")
+    metrics = Metrics() if args.metrics else None
+    bytesPerTransaction = measure_memory_per_transaction(params, args.numOfSites, args.numOfVariables)
+    for cc, policy in runs:
+        report, metrics = run_isolated(params, args.numOfSites, args.numOfVariables, args.traceMemory, metrics=metrics,
+                                       replicaSelection=args.replicaSelection, deadlockPolicy=policy,
+                                       detectionTrigger=detectionTrigger, concurrencyControl=cc, logLevel=args.logLevel)
+        report["bytesPerTransaction"] = bytesPerTransaction
+        print(format_report(get_run_name(None, cc, policy, len(controls), len(policies)), report))
+    if metrics is not None:
+        metrics.export_json(args.metrics)
+
+if __name__ == "__main__":
+    main()
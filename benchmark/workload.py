@@ -0,0 +1,122 @@
+"""
+Script that contains the synthetic workload generator.
+Workloads are generated line by line in the input format of `src/main.py`.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+from itertools import accumulate
+import random
+
+class ZipfSampler(object):
+    def __init__(self, names, skew, rng) -> None:
+        """
+        Initialize ZipfSampler.
+
+        Parameters
+        -----------
+        names: list
+            Names to sample from, the first one is the hottest.
+        skew: float
+            Zipf exponent; 0 samples uniformly.
+        rng: random.Random
+            Random number generator
+        """
+        self.names = names
+        self.rng = rng
+        self.cumWeights = list(accumulate(1 / (k ** skew) for k in range(1, len(names)+1)))
+
+    def sample(self):
+        return self.rng.choices(self.names, cum_weights=self.cumWeights)[0]
+
+def generate_workload(numOfTransactions, numOfVariables, numOfSites, opsPerTransaction=5, readRatio=0.5,
+                      roFraction=0.1, skew=0.0, failRate=0.0, recoverRate=0.0, concurrency=10, seed=0):
+    """
+    Generate a workload of interleaved transactions.
+
+    Parameters
+    -----------
+    numOfTransactions: int
+        Number of transactions
+    numOfVariables: int
+        Number of variables
+    numOfSites: int
+        Number of sites
+    opsPerTransaction: int
+        Number of reads and writes per transaction
+    readRatio: float
+        Probability that an operation of a read write transaction is a read
+    roFraction: float
+        Fraction of read only transactions
+    skew: float
+        Zipf exponent of variable accesses; 0 for uniform accesses
+    failRate: float
+        Probability of failing an active site at each step
+    recoverRate: float
+        Probability of recovering a failed site at each step
+    concurrency: int
+        Maximum number of transactions running at the same time
+    seed: int
+        Random seed
+
+    Returns: generator
+    -----------
+    Generator of input lines (without line breaks).
+    """
+    rng = random.Random(seed)
+    variables = ZipfSampler([f"x{i}" for i in range(1, numOfVariables+1)], skew, rng)
+    upSites = list(range(1, numOfSites+1))
+    downSites = []
+
+    # transaction name -> [read only, remaining operations]
+    active = {}
+    numOfStarted = 0
+    while numOfStarted < numOfTransactions or active:
+        if failRate and upSites and rng.random() < failRate:
+            site = upSites.pop(rng.randrange(len(upSites)))
+            downSites.append(site)
+            yield f"fail({site})"
+        if recoverRate and downSites and rng.random() < recoverRate:
+            site = downSites.pop(rng.randrange(len(downSites)))
+            upSites.append(site)
+            yield f"recover({site})"
+
+        if numOfStarted < numOfTransactions and len(active) < concurrency:
+            numOfStarted += 1
+            t = f"T{numOfStarted}"
+            readOnly = rng.random() < roFraction
+            active[t] = [readOnly, opsPerTransaction]
+            yield f"beginRO({t})" if readOnly else f"begin({t})"
+            continue
+
+        t = rng.choice(list(active))
+        readOnly, remaining = active[t]
+        if remaining == 0:
+            active.pop(t)
+            yield f"end({t})"
+            continue
+
+        active[t][1] -= 1
+        x = variables.sample()
+        if readOnly or rng.random() < readRatio:
+            yield f"R({t},{x})"
+        else:
+            yield f"W({t},{x},{rng.randrange(1000)})"
+
+def write_workload(path, **params):
+    """
+    Write a generated workload to a file.
+
+    Parameters
+    -----------
+    path: str
+        Output file path
+    params:
+        Parameters of `generate_workload`
+    """
+    with open(path, 'w') as output:
+        for line in generate_workload(**params):
+            output.write(line + "\n")
@@ -7,19 +7,176 @@ Script that contains the implementation of the lock object.
 
 """
 
-class Lock(object):
-    def __init__(self, state, transaction) -> None:
-        self.state = state
-        # transaction object
-        self.transaction = transaction
-        # self.lockedTime = tick
-        self.linedUp = False
-
-    def __iter__(self):
-        yield "state", self.state
-        yield "transaction", self.transaction
-        yield "linedUp", self.linedUp
-
-    def __eq__(self, other): 
-        return isinstance(other, type(self)) \
-            and self.state == other.state and self.transaction == other.transaction
\ No newline at end of file
+from const import LockState
+
+class LockEntry(object):
+    __slots__ = ('exclusive', 'shared', 'numContended', 'queue')
+
+    def __init__(self) -> None:
+        """
+        Initialize the lock entry of one variable on one site.
+        """
+        # transaction object holding the write lock
+        self.exclusive = None
+        # transaction objects holding read locks, in the order they were granted, 
+        # mapped to whether a write lock has been requested since (new readers then have to wait)
+        self.shared = {}
+        self.numContended = 0
+        # FIFO queue of transaction objects lined up for the write lock, new readers have to wait for them
+        self.queue = {}
+
+    def __repr__(self) -> str:
+        return f"LockEntry(exclusive={self.exclusive}, shared={list(self.shared)}, queue={list(self.queue)})"
+
+    def is_empty(self):
+        return self.exclusive is None and not self.shared and not self.queue
+
+    def holds(self, transaction):
+        """ Return True if transaction holds a read or write lock. """
+        return self.exclusive == transaction or transaction in self.shared
+
+    def get_holders(self):
+        """ Return the list of transaction objects holding a lock. """
+        if self.exclusive is not None:
+            return [self.exclusive]
+        return list(self.shared)
+
+    def get_r_lock_block(self, transaction):
+        """
+        Check whether read lock can be acquired.
+
+        Parameters
+        -----------
+        transaction: Transaction Object
+
+        Returns: list
+        -----------
+        List of transaction object that is blocking this read lock; 
+        return empty list if read lock can be acquired.
+        """
+        if self.exclusive is None and not self.numContended and not self.queue:
+            return []
+
+        blockedBy = []
+        if self.exclusive is not None and self.exclusive != transaction:
+            # write lock by other transaction
+            blockedBy.append(self.exclusive)
+        if self.numContended:
+            # some transaction is currently waiting for these read locks to release
+            blockedBy += [t for t, contended in self.shared.items() if contended]
+        # some transaction is lined up for the write lock, because it is blocked on other sites
+        blockedBy += list(self.queue)
+        return blockedBy
+
+    def get_rw_lock_block(self, transaction):
+        """
+        Check whether write lock can be acquired. 
+        Read locks of other transactions are marked as contended.
+
+        Parameters
+        -----------
+        transaction: Transaction Object
+
+        Returns: list
+        -----------
+        List of transaction object that is blocking this write lock; 
+        return empty list if write lock can be acquired.
+        """
+        if self.exclusive is not None:
+            return [self.exclusive] if self.exclusive != transaction else []
+
+        blockedBy = []
+        for t, contended in self.shared.items():
+            if t != transaction and not contended:
+                self.shared[t] = True
+                self.numContended += 1
+            if t != transaction or contended:
+                blockedBy.append(t)
+        return blockedBy
+
+    def grant_r_lock(self, transaction):
+        """
+        Grant read lock, the caller should have checked it can be acquired.
+
+        Returns: bool
+        -----------
+        False if transaction already holds a read or write lock.
+        """
+        if self.holds(transaction):
+            return False
+        self.shared[transaction] = False
+        return True
+
+    def grant_rw_lock(self, transaction):
+        """
+        Grant write lock, upgrading the read lock of the same transaction. 
+        The caller should have checked it can be acquired.
+
+        Returns: bool
+        -----------
+        False if transaction already holds the write lock.
+        """
+        if self.exclusive == transaction:
+            return False
+        self._release_shared(transaction)
+        self.exclusive = transaction
+        return True
+
+    def reserve_rw_lock(self, transaction):
+        """
+        Check whether write lock can be acquired and grant it in the same step.
+
+        Parameters
+        -----------
+        transaction: Transaction Object
+
+        Returns: tuple (list, LockState Enum)
+        -----------
+        First element is the list of transaction objects blocking this write lock, empty if granted.
+        Second element is the lock transaction held before the grant (None if no lock), 
+        to cancel the reservation with.
+        """
+        blockedBy = self.get_rw_lock_block(transaction)
+        if blockedBy:
+            return (blockedBy, None)
+        priorLock = None
+        if self.exclusive == transaction:
+            priorLock = LockState.RW_LOCK
+        elif transaction in self.shared:
+            priorLock = LockState.R_LOCK
+        self.grant_rw_lock(transaction)
+        return ([], priorLock)
+
+    def cancel_rw_lock(self, transaction, priorLock):
+        """ Give back a write lock granted by `reserve_rw_lock`, restoring the lock held before. """
+        if priorLock == LockState.RW_LOCK:
+            return
+        self.exclusive = None
+        if priorLock == LockState.R_LOCK:
+            # the only reader when the write lock was granted, so not contended
+            self.shared[transaction] = False
+
+    def line_up(self, transaction):
+        """ Line transaction up for the write lock. """
+        self.queue[transaction] = True
+
+    def is_lined_up(self, transaction):
+        return transaction in self.queue
+
+    def release(self, transaction):
+        """ Release locks of transaction and remove it from the queue. """
+        if self.exclusive == transaction:
+            self.exclusive = None
+        self._release_shared(transaction)
+        self.queue.pop(transaction, None)
+
+    def clear_locks(self):
+        """ Drop all lock holders, the queue is kept. """
+        self.exclusive = None
+        self.shared = {}
+        self.numContended = 0
+
+    def _release_shared(self, transaction):
+        if transaction in self.shared:
+            if self.shared.pop(transaction):
+                self.numContended -= 1
\ No newline at end of file
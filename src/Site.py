@@ -7,13 +7,17 @@ Script that contains the implementation of the site object.
 
 """
 
-from Lock import Lock
-from const import LockState
+from Lock import LockEntry
+from const import AbortReason, LockState
+from array import array
+from bisect import bisect_left
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Variable:
+    __slots__ = ('name', 'value', 'lastCommittedTime', 'isReplicated')
+
     def __init__(self, name, value, isReplicated) -> None:
         """
         Initialize the Variable.
@@ -40,8 +44,193 @@ class Variable:
     def __repr__(self) -> str:
         return f"{self.name}: {self.value}"
 
+class VariableStore:
+    def __init__(self, variables) -> None:
+        """
+        Initialize the committed storage of a site. 
+        Values and commit ticks are kept in typed arrays, Variable objects are only created when read.
+
+        Parameters
+        -----------
+        variables: list 
+            List of Variable object for initialization, ordered by variable index
+        """
+        # slot of each variable name, and per slot: name, latest committed value, its commit tick, 
+        # and whether the variable is replicated
+        self.slots = {}
+        self.names = []
+        self.values = array('q')
+        self.commitTimes = array('q')
+        self.replicated = array('b')
+        for var in variables:
+            self.slots[var.name] = len(self.names)
+            self.names.append(var.name)
+            self.values.append(int(var.value))
+            self.commitTimes.append(var.lastCommittedTime)
+            self.replicated.append(var.isReplicated)
+
+        # slot -> (commit ticks, values) of older versions kept for read only transactions, ordered by commit tick
+        self.oldVersions = {}
+        # number of older versions kept, and the largest number kept at once
+        self.numOfOldVersions = 0
+        self.peakOldVersions = 0
+
+    def __contains__(self, x) -> bool:
+        return x in self.slots
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get(self, x):
+        """ Return the latest committed version of x as a Variable object. """
+        slot = self.slots[x]
+        var = Variable(x, self.values[slot], bool(self.replicated[slot]))
+        var.lastCommittedTime = self.commitTimes[slot]
+        return var
+
+    @classmethod
+    def from_arrays(cls, names, values, commitTimes, replicated):
+        """
+        Build the committed storage from its arrays, e.g. loaded from a database image.
+
+        Parameters
+        -----------
+        names: list
+            Variable names, ordered by variable index
+        values: array
+            Committed values by slot
+        commitTimes: array
+            Commit ticks by slot
+        replicated: array
+            Whether each variable is replicated, by slot
+        """
+        store = cls([])
+        store.names = names
+        store.slots = dict(zip(names, range(len(names))))
+        store.values = values
+        store.commitTimes = commitTimes
+        store.replicated = replicated
+        return store
+
+    def load_values(self, values):
+        """
+        Replace the committed values, e.g. restored from a checkpoint; 
+        they are treated as committed before the run starts.
+
+        Parameters
+        -----------
+        values: array
+            Committed values by slot
+        """
+        self.values = values
+        self.commitTimes = array('q', [-1] * len(values))
+        self.oldVersions = {}
+        self.numOfOldVersions = 0
+
+    def get_last_committed_time(self, x):
+        return self.commitTimes[self.slots[x]]
+
+    def is_replicated(self, x):
+        return bool(self.replicated[self.slots[x]])
+
+    def commit(self, x, value, tick, watermark):
+        """
+        Install a newly committed value, keeping the previous one if a read only transaction may see it.
+
+        Parameters
+        -----------
+        x: str
+            Variable name
+        value: int
+            Committed value
+        tick: int
+            Commit tick
+        watermark: int
+            Start time of the oldest active read only transaction; None if there is none.
+        """
+        slot = self.slots[x]
+        if watermark is not None:
+            if slot not in self.oldVersions:
+                self.oldVersions[slot] = (array('q'), array('q'))
+            ticks, values = self.oldVersions[slot]
+            ticks.append(self.commitTimes[slot])
+            values.append(self.values[slot])
+            self.numOfOldVersions += 1
+            if self.numOfOldVersions > self.peakOldVersions:
+                self.peakOldVersions = self.numOfOldVersions
+
+        self.values[slot] = value
+        self.commitTimes[slot] = tick
+        if slot in self.oldVersions:
+            self._trim_slot(slot, watermark)
+
+    def get_version_before(self, x, tick):
+        """
+        Get the version of x committed most recently before tick.
+
+        Parameters
+        -----------
+        x: str
+            Variable name
+        tick: int
+
+        Returns: Variable
+        -----------
+        The Variable object; None if no version was committed before tick.
+        """
+        slot = self.slots[x]
+        if self.commitTimes[slot] < tick:
+            return self.get(x)
+
+        ticks, values = self.oldVersions.get(slot, ((), ()))
+        i = bisect_left(ticks, tick)
+        if i == 0:
+            return None
+        var = Variable(x, values[i-1], bool(self.replicated[slot]))
+        var.lastCommittedTime = ticks[i-1]
+        return var
+
+    def trim(self, watermark):
+        """
+        Drop versions that no read only transaction starting at or after watermark can see,
+        i.e. all but the latest version committed before watermark and the newer ones.
+
+        Parameters
+        -----------
+        watermark: int
+            Start time of the oldest active read only transaction; 
+            None if there is none, then only the latest versions are kept.
+
+        Returns: int
+        -----------
+        Number of dropped versions.
+        """
+        return sum(self._trim_slot(slot, watermark) for slot in list(self.oldVersions))
+
+    def _trim_slot(self, slot, watermark):
+        ticks, values = self.oldVersions[slot]
+        if watermark is None or self.commitTimes[slot] < watermark:
+            # the latest version is the one visible at watermark
+            drop = len(ticks)
+        else:
+            drop = max(bisect_left(ticks, watermark) - 1, 0)
+        if drop:
+            del ticks[:drop]
+            del values[:drop]
+            self.numOfOldVersions -= drop
+        if not ticks:
+            self.oldVersions.pop(slot)
+        return drop
+
+    def get_retained_version_count(self, peak=False):
+        """ Return the total number of committed versions kept, or the largest number kept at once if peak. """
+        return len(self.names) + (self.peakOldVersions if peak else self.numOfOldVersions)
+
 class Site:
-    def __init__(self, name, variables) -> None:
+    def __init__(self, name, variables, log=None) -> None:
         """
         Initialize the site.
 
@@ -49,22 +238,40 @@ class Site:
         -----------
         name: str 
             Site Name.
-        variables: list 
-            List of Variable object for initialization
+        variables: list or VariableStore
+            List of Variable object for initialization, or the committed storage itself
+        log: SiteLog
+            Write-ahead log of this site in durable mode; committed values are restored from it if it exists.
         """
 
         self.name = name
+        # variable name -> LockEntry
         self.lockTable = {}
+        # largest number of lock table entries at once
+        self.peakLockTableSize = 0
+        # running number of read and write locks held, and of transactions lined up for write locks
+        self.numOfLocksHeld = 0
+        self.numOfLinedUp = 0
         self.curWrites = {}
-        self.curReads = []
-        self.committedVariables = {}
-        for var in variables:
-            self.committedVariables[var.name] = var
+        # transactions that read on this site, kept as an ordered set
+        self.curReads = {}
+        self.committedVariables = variables if isinstance(variables, VariableStore) else VariableStore(variables)
+        # start time of the oldest active read only transaction
+        self.snapshotWatermark = None
         
-        self.copies = {}
-        self.liningUp = {}
         self.isActive = False
         self.recoveredTime = -1
+        # ticks this site failed or recovered, and (isActive, recoveredTime) after each of them
+        self.statusTimes = []
+        self.statusHistory = []
+
+        self.log = log
+        if log is not None:
+            values = log.restore(len(self.committedVariables))
+            if values is None:
+                log.checkpoint(self.committedVariables.values)
+            else:
+                self.committedVariables.load_values(values)
 
     def __repr__(self) -> str:
         return self.name
@@ -72,28 +279,119 @@ class Site:
     def ifContains(self,x):
         return x in self.committedVariables
 
-    def request_copy_for_RO(self, transaction):
+    def get_committed(self, x):
+        """ Return the latest committed Variable object of x. """
+        return self.committedVariables.get(x)
+
+    def get_retained_version_count(self, peak=False):
+        """ Return the total number of committed versions kept on this site, or the largest number kept at once if peak. """
+        return self.committedVariables.get_retained_version_count(peak)
+
+    def sync_log(self):
+        """ Make the commits of this tick durable, and checkpoint if enough commits were logged. """
+        if self.log is not None and self.log.sync():
+            self.log.checkpoint(self.committedVariables.values)
+
+    def get_last_committed_times(self, variables):
+        """
+        Get the commit tick of the latest committed version of each variable, for optimistic validation.
+
+        Parameters
+        -----------
+        variables: list
+            Names of variables stored on this site
+
+        Returns: list
+        -----------
+        List of commit ticks, in the order of variables.
+        """
+        return [self.committedVariables.get_last_committed_time(x) for x in variables]
+
+    def get_lock_table_size(self, peak=False):
+        """ Return the number of variables with locks or lined-up writers on this site, or the largest number at once if peak. """
+        return self.peakLockTableSize if peak else len(self.lockTable)
+
+    def get_num_of_locks_held(self):
+        """ Return the number of read and write locks held on this site. """
+        return self.numOfLocksHeld
+
+    def get_num_of_lined_up(self):
+        """ Return the number of transactions lined up for write locks on this site. """
+        return self.numOfLinedUp
+
+    def has_lined_up_writer(self, x):
+        """ Return True if a transaction is lined up for the write lock of x on this site. """
+        entry = self.lockTable.get(x)
+        return entry is not None and bool(entry.queue)
+
+    def trim_versions(self, watermark):
+        """
+        Update the snapshot watermark and drop versions no active read only transaction can see.
+        Only variables that still keep old versions are visited.
+
+        Parameters
+        -----------
+        watermark: int
+            Start time of the oldest active read only transaction; None if there is none.
+
+        Returns: bool
+        -----------
+        True if older versions are still kept.
+        """
+        self.snapshotWatermark = watermark
+        dropped = self.committedVariables.trim(watermark)
+        if dropped:
+            logger.debug("Site %s - dropped %s old versions, watermark %s.", self.name, dropped, watermark)
+        return bool(self.committedVariables.oldVersions)
+
+    def _get_recovered_time_at(self, tick):
+        """
+        Get the time this site last recovered before tick.
+
+        Parameters
+        -----------
+        tick: int
+
+        Returns: int
+        -----------
+        The recover time; None if the site was down at tick.
         """
-        Store copy of variables.
+        i = bisect_left(self.statusTimes, tick)
+        if i == 0:
+            return None
+        isActive, recoveredTime = self.statusHistory[i-1]
+        if not isActive:
+            return None
+        return recoveredTime
+
+    def get_snapshot_version(self, transaction, x):
+        """
+        Get the version of x visible to a read only transaction, 
+        i.e. the version committed before it began, if this site was up at that time 
+        and, for replicated variables, the version was committed after the site recovered.
 
         Parameters
         -----------
         transaction: Transaction Object
+        x: str
+            Variable name 
+
+        Returns: Variable
+        -----------
+        The visible Variable object; None if there is no visible version on this site.
         """
-        # if transaction.name not in self.copies:
-        #     self.copies[transaction.name] = {}
-        # self.copies[transaction.name] = self.committedVariables.copy()
+        if x not in self.committedVariables:
+            return None
 
-        curCopies = {}
-        for committedValue in self.committedVariables.values():
-            if (committedValue.lastCommittedTime < transaction.startTime and \
-                self.recoveredTime <= committedValue.lastCommittedTime) or \
-                    not committedValue.isReplicated:
-                curCopies[committedValue.name] = committedValue
-        
-        self.copies[transaction.name] = curCopies
+        recoveredTime = self._get_recovered_time_at(transaction.startTime)
+        if recoveredTime is None:
+            return None
+
+        version = self.committedVariables.get_version_before(x, transaction.startTime)
+        if version is None or (version.isReplicated and version.lastCommittedTime < recoveredTime):
+            return None
 
-        logger.debug(f"Stored copy for RO transaction {transaction}: {self.copies}")
+        return version
 
     def if_available_to_read(self, transaction, x):
         """
@@ -115,7 +413,7 @@ class Site:
         # if self.recoveredTime > transaction.startTime:
         #     return False
 
-        if self.committedVariables[x].lastCommittedTime < self.recoveredTime:
+        if self.committedVariables.get_last_committed_time(x) < self.recoveredTime:
             return False
 
         return True
@@ -138,17 +436,20 @@ class Site:
         # if self.recoveredTime > transaction.startTime:
         #     return False
 
-        if transaction.name not in self.copies:
-            logger.debug(f"Site {self.name}: There is no copy for {transaction.name}!! {self.copies}")
-            return False
-
-        varCopy = self.copies[transaction.name]
-        if x not in varCopy:
-            logger.debug(f"Site {self.name}: {x} is not in the copy of Site {self.name} {varCopy}")
+        if self.get_snapshot_version(transaction, x) is None:
+            logger.debug("Site %s: %s has no version visible to %s", self.name, x, transaction.name)
             return False
 
         return True
 
+    def _get_lock_entry(self, x):
+        """ Get the lock entry of x, create one if not exist. """
+        if x not in self.lockTable:
+            self.lockTable[x] = LockEntry()
+            if len(self.lockTable) > self.peakLockTableSize:
+                self.peakLockTableSize = len(self.lockTable)
+        return self.lockTable[x]
+
     def lock_lining_up(self, transaction, x):
         """
         Store the information which transaction is waiting for a lock to release 
@@ -159,26 +460,49 @@ class Site:
 		x: str
             Variable name 
         """
-        if x not in self.liningUp:
-            self.liningUp[x] = []
-
-        self.liningUp[x].append(transaction)
+        entry = self._get_lock_entry(x)
+        # retried operations should not line up the same transaction twice
+        if not entry.is_lined_up(transaction):
+            entry.line_up(transaction)
+            self.numOfLinedUp += 1
+            transaction.touch(self.name, x)
 
-    def remove_from_lock_lineup(self, transaction):
+    def remove_from_lock_lineup(self, transaction, variables):
         """
         Remove from the line
 
         Parameters
         -----------
         transaction: Transaction Object
+        variables: iterable
+            Variable names the transaction may be lined up on
+        """
+        for var in variables:
+            if var in self.lockTable and self.lockTable[var].queue.pop(transaction, None):
+                self.numOfLinedUp -= 1
+
+    def get_touched_variables(self, transaction):
         """
-        for var, ts in self.liningUp.items():
-            if transaction in ts:
-                ts.remove(transaction)
-            self.liningUp[var] = ts
+        Get variables on which the transaction holds a lock, is lined up or has written.
+        Only the variables the transaction recorded for this site are checked.
 
+        Parameters
+        -----------
+        transaction: Transaction Object
+
+        Returns: set
+        -----------
+        Set of variable names.
+        """
+        touched = set()
+        writes = self.curWrites.get(transaction, {})
+        for x in transaction.get_touched_variables(self.name):
+            entry = self.lockTable.get(x)
+            if x in writes or (entry is not None and (entry.holds(transaction) or entry.is_lined_up(transaction))):
+                touched.add(x)
+        return touched
 
-    def _get_r_lock_block(self, transaction, x):
+    def get_r_lock_block(self, transaction, x):
         """
         Check whether read lock can be acquire.
 
@@ -193,28 +517,12 @@ class Site:
 		List of transaction object that is blocking this read lock; 
         return empty list if read lock can be acquire.
         """
+        if x not in self.lockTable:
+            return []
 
-        blockedBy = []
-        if x in self.lockTable:
-            lockObjs = self.lockTable[x]
-            for lock in lockObjs:
-                # write lock by other transaction
-                ifWLock = lock.state == LockState.RW_LOCK and lock.transaction != transaction
-                # some transaction is currently waiting for this lock to release
-                ifLockWaitUp = lock.state == LockState.R_LOCK and lock.linedUp
-                
-                if ifWLock or ifLockWaitUp:
-                    # write lock from other transaction
-                    lock.linedUp = True
-                    blockedBy.append(lock.transaction)
-
-        # no lock on this variable on current site, 
-        # but some transaction is waiting to acquiring a write lock, 
-        # because there is a read lock on this variable on other site
-        if x in self.liningUp:
-            blockedBy+=self.liningUp[x]
-
-        return blockedBy
+        # blocked by a write lock from other transaction, read locks some transaction is waiting for,
+        # and transactions lined up for a write lock because there is a read lock on this variable on other site
+        return self.lockTable[x].get_r_lock_block(transaction)
 
     def get_rw_lock_block(self, transaction, x):
         """
@@ -231,15 +539,61 @@ class Site:
 		List of transaction object that is blocking this write lock; 
         return empty list if read lock can be acquire.
         """
-        blockedBy = []
-        if x in self.lockTable:
-            lockObjs = self.lockTable[x]
-            for lock in lockObjs:
-                if lock.transaction != transaction or (lock.state == LockState.R_LOCK and lock.linedUp):
-                    # read or write lock from other transaction
-                    lock.linedUp = True
-                    blockedBy.append(lock.transaction)
-        return blockedBy
+        if x not in self.lockTable:
+            return []
+
+        # read or write lock from other transaction
+        return self.lockTable[x].get_rw_lock_block(transaction)
+
+    def reserve_rw_lock(self, transaction, x, tick):
+        """
+        Check if write lock can be acquired, and lock if so, with one visit of the lock table. 
+        The data manager cancels the reservation if the write is blocked on another site.
+
+        Parameters
+        -----------
+        transaction: transaction object
+        x: str
+            Variable name 
+        tick: int 
+            Current tick
+
+        Returns: tuple (list, LockState Enum)
+        -----------
+        First element is the list of transaction object that is blocking the write lock, empty if locked.
+        Second element is the lock the transaction held on x before, None if no lock.
+        """
+        blockedBy, priorLock = self._get_lock_entry(x).reserve_rw_lock(transaction)
+        if not blockedBy:
+            if priorLock is None:
+                self.numOfLocksHeld += 1
+            transaction.touch(self.name, x)
+            logger.debug("Site %s - %s reserved %s with %s.", self.name, transaction.name, x, LockState.RW_LOCK)
+        return (blockedBy, priorLock)
+
+    def cancel_rw_lock_reservation(self, transaction, x, priorLock, lineUp):
+        """
+        Give back a write lock reserved by `reserve_rw_lock`.
+
+        Parameters
+        -----------
+        transaction: transaction object
+        x: str
+            Variable name 
+        priorLock: LockState Enum
+            Lock returned by `reserve_rw_lock`
+        lineUp: bool
+            Line the transaction up for the write lock, because it waits for it on other sites
+        """
+        entry = self.lockTable[x]
+        entry.cancel_rw_lock(transaction, priorLock)
+        if priorLock is None:
+            self.numOfLocksHeld -= 1
+        logger.debug("Site %s - %s cancelled reservation of %s.", self.name, transaction.name, x)
+        if lineUp:
+            self.lock_lining_up(transaction, x)
+        elif entry.is_empty():
+            self.lockTable.pop(x)
 
     def lock_variable(self, transaction, x, lock_state, tick):
         """
@@ -264,40 +618,29 @@ class Site:
         # check if can lock
         blockedBy = []
         if lock_state == LockState.R_LOCK:
-            blockedBy = self._get_r_lock_block(transaction, x)
+            blockedBy = self.get_r_lock_block(transaction, x)
         else:
             blockedBy = self.get_rw_lock_block(transaction, x)
 
         if blockedBy:
             return blockedBy
 
-        lockObj = Lock(lock_state, transaction)
-        if x not in self.lockTable:
-            self.lockTable[x] = [lockObj]
-            logger.debug(f"Site {self.name} - {transaction.name} successfully locked {x} with {lock_state}.")
-            return blockedBy
-        
-        locks = self.lockTable[x]
-        if lockObj in locks:
-            logger.debug(f"Site {self.name} - {transaction.name} already locked {x} with {lock_state}.")
-            return blockedBy
-
+        transaction.touch(self.name, x)
+        entry = self._get_lock_entry(x)
         if lock_state == LockState.R_LOCK:
-            tempLockObj = Lock(LockState.RW_LOCK, transaction)
-            if tempLockObj in locks:
-                logger.debug(f"Site {self.name} - {transaction.name} already locked {x} with {LockState.RW_LOCK}.")
-                return blockedBy 
-
-        
-        if lock_state == LockState.RW_LOCK:
-            # remove read lock from the same transaction
-            newLocks = [lock for lock in locks if not (lock.state == LockState.R_LOCK and lock.transaction == transaction)]
-            self.lockTable[x] = newLocks
-            logger.debug(f"Site {self.name} - {transaction.name} removed {LockState.R_LOCK} on {x}.")
-
-        # lock x
-        self.lockTable[x].append(lockObj)
-        logger.debug(f"Site {self.name} - {transaction.name} successfully locked {x} with {lock_state}.")
+            granted = entry.grant_r_lock(transaction)
+            upgraded = False
+        else:
+            # upgrade the read lock from the same transaction
+            upgraded = transaction in entry.shared
+            granted = entry.grant_rw_lock(transaction)
+        if granted and not upgraded:
+            self.numOfLocksHeld += 1
+
+        if granted:
+            logger.debug("Site %s - %s successfully locked %s with %s.", self.name, transaction.name, x, lock_state)
+        else:
+            logger.debug("Site %s - %s already locked %s.", self.name, transaction.name, x)
         return blockedBy
 
     def recover(self, tick):
@@ -312,6 +655,8 @@ class Site:
 
         self.isActive = True
         self.recoveredTime = tick
+        self.statusTimes.append(tick)
+        self.statusHistory.append((self.isActive, self.recoveredTime))
         # logger.info(f"{tick}: Recovered Site.")
 
     def fail(self, tick):
@@ -323,18 +668,30 @@ class Site:
         -----------
 		tick: int
             The time this site fails
+
+        Returns: list
+        -----------
+        List of transaction objects that are notified to abort.
         """
         self.isActive = False
-        for t in self.curReads:
+        self.statusTimes.append(tick)
+        self.statusHistory.append((self.isActive, self.recoveredTime))
+        notified = list(self.curReads) + list(self.curWrites.keys())
+        for t in notified:
             t.abort = True
+            if t.abortReason is None:
+                t.abortReason = AbortReason.SITE_FAILURE
 
-        for t in self.curWrites.keys():
-            t.abort = True
-
-        self.curReads = []
+        self.curReads = {}
         self.curWrites = {}
-        self.lockTable = {}
+        # transactions lined up for a write lock keep waiting after the failure
+        for x, entry in list(self.lockTable.items()):
+            entry.clear_locks()
+            if entry.is_empty():
+                self.lockTable.pop(x)
+        self.numOfLocksHeld = 0
         # logger.info(f"{tick}: Failed Site.")
+        return notified
 
     def read_only(self, transaction, x):
         """
@@ -350,21 +707,16 @@ class Site:
         -----------
         The value of x; None if read failed.
         """
-        logger.debug(f"Site {self.name} - {transaction.name} read only {x}.")
-        if transaction.name not in self.copies:
-            logger.error(f"Site {self.name} - Failed to read only: There is no copy for {transaction.name}!! {self.copies}")
-            return None
-
-        varCopy = self.copies[transaction.name]
-
-        if x not in varCopy:
-            logger.error(f"Site {self.name} - Failed to read only: {x} is not in the copy!! {varCopy}")
+        logger.debug("Site %s - %s read only %s.", self.name, transaction.name, x)
+        version = self.get_snapshot_version(transaction, x)
+        if version is None:
+            logger.error("Site %s - Failed to read only: %s has no version visible to %s!!", self.name, x, transaction.name)
             return None
 
         # if transaction not in self.curReads:
         #     self.curReads.append(transaction)
 
-        return varCopy[x]
+        return version
 
     def read(self, transaction, x):
         """
@@ -381,19 +733,19 @@ class Site:
         The value of x; None if read failed.
         """
         # t = transaction.name
-        logger.debug(f"Site {self.name} - {transaction.name} read {x}.")
+        logger.debug("Site %s - %s read %s.", self.name, transaction.name, x)
         if transaction in self.curWrites and x in self.curWrites[transaction]:
             # when t previously wrote to x but not committed yet
-            return self.curWrites[transaction][x]
+            return Variable(x, self.curWrites[transaction][x], self.committedVariables.is_replicated(x))
 
         if x not in self.committedVariables:
-            logger.error(f"Site {self.name} - Failed to read: {x} is not in committed variable!! {self.committedVariables}")
+            logger.error("Site %s - Failed to read: %s read by %s is not in committed variables!!", self.name, x, transaction.name)
             return None
 
-        if transaction not in self.curReads:
-            self.curReads.append(transaction)
+        self.curReads[transaction] = True
+        transaction.touch(self.name, x)
 
-        return self.committedVariables[x]
+        return self.get_committed(x)
 
     def write(self, transaction, x, val):
         """
@@ -404,41 +756,56 @@ class Site:
         transaction: transaction object
         x: str
             Variable name 
-        val: str
+        val: int
             The value to write
         """
-        logger.debug(f"Site {self.name} - {transaction.name} write {x}={val}")
+        logger.debug("Site %s - %s write %s=%s", self.name, transaction.name, x, val)
         if transaction not in self.curWrites:
             self.curWrites[transaction] = {}
+        transaction.touch(self.name, x)
 
-        self.curWrites[transaction][x] = Variable(x, val, self.committedVariables[x].isReplicated)
+        # only keep the value, a Variable object is built if t reads x back
+        self.curWrites[transaction][x] = val
 
-        logger.info(f"Site {self.name}: {transaction.name} write {x}={val}")
+        logger.info("Site %s: %s write %s=%s", self.name, transaction.name, x, val)
 
-    def abort(self, transaction):
+    def _release(self, transaction):
         """
-        Transaction abort. 
+        Release reads, locks and lined up entries of the transaction on the variables it touched on this site.
 
         Parameters
         -----------
         transaction: transaction object
         """
-        
-        if transaction in self.curReads:
-            self.curReads.remove(transaction)
-        if transaction in self.curWrites:
-            self.curWrites.pop(transaction)
+        self.curReads.pop(transaction, None)
+        for x in transaction.get_touched_variables(self.name):
+            entry = self.lockTable.get(x)
+            if entry is None:
+                continue
+            self.numOfLocksHeld -= entry.holds(transaction)
+            self.numOfLinedUp -= entry.is_lined_up(transaction)
+            entry.release(transaction)
+            if entry.is_empty():
+                self.lockTable.pop(x)
 
-        if transaction.name in self.copies:
-            self.copies.pop(transaction.name)
+    def abort(self, transaction):
+        """
+        Transaction abort. 
 
-        self.remove_from_lock_lineup(transaction)
+        Parameters
+        -----------
+        transaction: transaction object
 
-        for x, lockObjs in self.lockTable.items():
-            newLockLst = [lock for lock in lockObjs if lock.transaction != transaction]
-            self.lockTable[x] = newLockLst
+        Returns: set
+        -----------
+        Set of variable names whose locks or lined up transactions are released.
+        """
+        touched = self.get_touched_variables(transaction)
+        self.curWrites.pop(transaction, None)
+        self._release(transaction)
 
-        logger.debug(f"Site {self.name} - {transaction.name} aborted.")
+        logger.debug("Site %s - %s aborted.", self.name, transaction.name)
+        return touched
 
     def commit(self, transaction, tick):
         """
@@ -449,27 +816,23 @@ class Site:
         transaction: transaction object
         tick: int
             Current tick
-        """
-        
-        if transaction in self.curReads:
-            self.curReads.remove(transaction)
 
+        Returns: set
+        -----------
+        Set of variable names whose locks, lined up transactions or committed values changed.
+        """
+        touched = self.get_touched_variables(transaction)
         if transaction in self.curWrites:
             allWritesDict = self.curWrites[transaction]
-            for x, v in allWritesDict.items():
-                v.lastCommittedTime = tick
-                self.committedVariables[x] = v
+            for x, val in allWritesDict.items():
+                self.committedVariables.commit(x, val, tick, self.snapshotWatermark)
+                if self.log is not None:
+                    self.log.append(tick, self.committedVariables.slots[x], int(val))
 
             self.curWrites.pop(transaction)
 
-        if transaction.name in self.copies:
-            self.copies.pop(transaction.name)
-
-        self.remove_from_lock_lineup(transaction)
-
-        for x, lockObjs in self.lockTable.items():
-            newLockLst = [lock for lock in lockObjs if lock.transaction != transaction]
-            self.lockTable[x] = newLockLst
+        self._release(transaction)
 
-        logger.debug(f"Site {self.name} - {transaction.name} committed.")
+        logger.debug("Site %s - %s committed.", self.name, transaction.name)
+        return touched
             
\ No newline at end of file
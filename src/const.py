@@ -18,6 +18,28 @@ class LockState(str, Enum):
 class OperationType(str, Enum):
     READ = "R"
     WRITE = "W"
+    # R(T, x1, x2, ...) and W(T, {x1: v1, x2: v2, ...}) in the input
+    BATCH_READ = "RB"
+    BATCH_WRITE = "WB"
+
+class AbortReason(str, Enum):
+    DEADLOCK = "deadlock"
+    SITE_FAILURE = "site_failure"
+    PENDING_OPERATIONS = "pending_operations"
+    NO_VISIBLE_VERSION = "no_visible_version"
+    CLIENT_DISCONNECTED = "client_disconnected"
+    WAIT_DIE = "wait_die"
+    WOUND_WAIT = "wound_wait"
+    VALIDATION_FAILED = "validation_failed"
+
+class DeadlockPolicy(str, Enum):
+    DETECTION = "detection"
+    WAIT_DIE = "waitDie"
+    WOUND_WAIT = "woundWait"
+
+class ConcurrencyControl(str, Enum):
+    LOCKING = "locking"
+    OPTIMISTIC = "optimistic"
 
 class ResultType(str, Enum):
     ABORT = "abort"
@@ -7,15 +7,21 @@ Script that contains the class that implements the data manager.
 
 """
 
-from Site import Site, Variable
+from Site import Site, Variable, VariableStore
+from array import array
 from const import LockState
+from placement import DefaultPlacement
+from replica_selection import FirstSelection
+from wal import SiteLog
+from image import read_image, save_image
+from site_process import RemoteSite, call_each_site, call_sites
 import logging
-import re
 
 logger = logging.getLogger(__name__)
 
 class DataMgr(object):
-    def __init__(self, numOfSites, numOfVariable) -> None:
+    def __init__(self, numOfSites, numOfVariable, placement=None, durableDir=None, checkpointInterval=1000,
+                 processPerSite=False, replicaSelection=None) -> None:
         """
         Initialize the Data Manger.
 
@@ -25,24 +31,202 @@ class DataMgr(object):
             Total number of sites.
         numOfVariable: str 
             Total number of variable.
+        placement: Placement
+            Policy deciding which sites store each variable, DefaultPlacement if None.
+        durableDir: str
+            Directory of the sites' write-ahead logs and checkpoints; None to keep sites in memory only.
+            Sites restore their committed values from it if it was used before.
+        checkpointInterval: int
+            Number of WAL records of a site after which it writes a checkpoint.
+        processPerSite: bool
+            If each site runs in its own process.
+        replicaSelection: ReplicaSelection
+            Policy ordering the sites to read replicated variables from, FirstSelection if None.
         """
         self.sites = {}
-        self._init_sites(numOfSites, numOfVariable)
-
-    def _init_sites(self, numOfSites, numOfVariable):
+        self.placement = placement if placement is not None else DefaultPlacement()
+        self.replicaSelection = replicaSelection if replicaSelection is not None else FirstSelection()
+        # site name -> number of successful reads served
+        self.readCounts = {}
+        # variable name -> names of the sites storing it, and the ones among them that are up
+        self.variableSites = {}
+        self.availableSitesOfVariable = {}
+        # wait list to notify when locks are released or sites change, attached by the transaction manager
+        self.waitLists = None
+        # start time of the oldest active read only transaction, the one each site last got,
+        # and names of the sites that may keep older versions
+        self.snapshotWatermark = None
+        self.siteWatermarks = {}
+        self.sitesWithVersions = set()
+        self._init_sites(numOfSites, numOfVariable, durableDir, checkpointInterval)
+        if processPerSite:
+            self.start_site_processes()
+
+    def _init_sites(self, numOfSites, numOfVariable, durableDir=None, checkpointInterval=1000):
         """
         Initialize sites.
-        The odd indexed variables are at one site each. Even indexed variables are at all sites. 
+        The placement policy decides the sites of each variable (by default, the odd indexed 
+        variables are at one site each and even indexed variables are at all sites). 
         Each variable xi is initialized to the value 10i (10 times i).
         """
-        # oddVars = [Variable("x"+str(i), 10*i) for i in range(1,numOfVariable+1) if not i%2]
+        # fill the storage arrays of each site directly, and share the site lists between variables
+        siteNames = {str(site): [] for site in range(1, numOfSites+1)}
+        siteValues = {site: array('q') for site in siteNames}
+        siteReplicated = {site: array('b') for site in siteNames}
+        siteLists = {}
+        keys = {}
+        for i in range(1, numOfVariable+1):
+            x = "x"+str(i)
+            key = tuple(self.placement.get_sites(i, numOfSites, numOfVariable))
+            if key not in siteLists:
+                siteLists[key] = [str(site) for site in key]
+            self.variableSites[x] = siteLists[key]
+            keys[x] = key
+            isReplicated = len(key) > 1
+            for site in siteLists[key]:
+                siteNames[site].append(x)
+                siteValues[site].append(10*i)
+                siteReplicated[site].append(isReplicated)
+
+        for site in siteNames:
+            log = SiteLog(durableDir, site, checkpointInterval) if durableDir is not None else None
+            commitTimes = array('q', [-1]) * len(siteNames[site])
+            variables = VariableStore.from_arrays(siteNames[site], siteValues[site], commitTimes, siteReplicated[site])
+            curSite = Site(site, variables, log)
+            curSite.recover(-1)
+            self.sites[site] = curSite
+
+        availableLists = {key: [self.sites[site] for site in sites if self.sites[site].isActive] 
+                          for key, sites in siteLists.items()}
+        for x, key in keys.items():
+            self.availableSitesOfVariable[x] = availableLists[key]
+
+    @classmethod
+    def load_image(cls, path, placement=None, replicaSelection=None, numOfSites=None, numOfVariable=None):
+        """
+        Create a data manager from a database image saved by `save_image`.
+        All ticks are shifted so that the latest saved tick becomes -1, i.e. before the new run starts.
+        The size and the placement are those of the image; if they are given, they have to match it.
 
-        for site in range(1, numOfSites+1):
-            evenVars = [Variable("x"+str(i), 10*i, isReplicated=True) for i in range(1,numOfVariable+1) if not i%2]
-            oddVars = [Variable("x"+str(i), 10*i, isReplicated=False) for i in range(1,numOfVariable+1) if i%2 and (i%10 +1) == site]
-            curSite = Site(str(site), evenVars+oddVars)
-            curSite.isActive = True
-            self.sites[str(site)] = curSite
+        Parameters
+        -----------
+        path: str
+            Image file path
+        placement: Placement
+            Kept as the placement policy; the saved placement of the variables has to be the one it gives.
+        replicaSelection: ReplicaSelection
+            Policy ordering the sites to read replicated variables from.
+        numOfSites: int
+            Expected number of sites
+        numOfVariable: int
+            Expected number of variables
+
+        Returns: DataMgr
+        -----------
+        The data manager.
+        """
+        image = read_image(path)
+        cls._check_image(image, path, placement, numOfSites, numOfVariable)
+        dataMgr = cls(0, 0, placement, replicaSelection=replicaSelection)
+
+        states = image["siteStates"]
+        latest = max([-1] + [max(state["commitTimes"], default=-1) for state in states] 
+                     + [max(state["statusTimes"], default=-1) for state in states])
+        shift = latest + 1
+
+        # share the name strings and the site lists between variables and sites
+        names = {i: "x"+str(i) for i in image["variableIndexes"]}
+        for state in states:
+            siteNames = [names[i] for i in state["variableIndexes"]]
+            commitTimes = state["commitTimes"]
+            if shift:
+                commitTimes = array('q', (t - shift for t in commitTimes))
+            site = Site(state["name"], [])
+            site.committedVariables = VariableStore.from_arrays(siteNames, state["values"], commitTimes, state["replicated"])
+            site.isActive = state["isActive"]
+            site.recoveredTime = state["recoveredTime"] - shift
+            site.statusTimes = [t - shift for t in state["statusTimes"]]
+            site.statusHistory = [(isActive, recoveredTime - shift) for isActive, recoveredTime in state["statusHistory"]]
+            dataMgr.sites[state["name"]] = site
+
+        sites = image["sites"]
+        siteLists = {}
+        availableLists = {}
+        begin = 0
+        for i, count in zip(image["variableIndexes"], image["siteCounts"]):
+            key = tuple(sites[begin:begin+count])
+            begin += count
+            if key not in siteLists:
+                siteLists[key] = [str(site) for site in key]
+                availableLists[key] = [dataMgr.sites[site] for site in siteLists[key] if dataMgr.sites[site].isActive]
+            x = names[i]
+            dataMgr.variableSites[x] = siteLists[key]
+            dataMgr.availableSitesOfVariable[x] = availableLists[key]
+        return dataMgr
+
+    @staticmethod
+    def _check_image(image, path, placement, numOfSites, numOfVariable):
+        """ Raise ValueError if the given size or placement does not match the image. """
+        numOfSavedSites = len(image["siteStates"])
+        numOfSavedVariables = len(image["variableIndexes"])
+        if numOfSites is not None and numOfSites != numOfSavedSites:
+            raise ValueError(f"{path} has {numOfSavedSites} sites, not {numOfSites}")
+        if numOfVariable is not None and numOfVariable != numOfSavedVariables:
+            raise ValueError(f"{path} has {numOfSavedVariables} variables, not {numOfVariable}")
+        if placement is None:
+            return
+        sites = image["sites"]
+        begin = 0
+        for i, count in zip(image["variableIndexes"], image["siteCounts"]):
+            saved = sites[begin:begin+count].tolist()
+            begin += count
+            if saved != list(placement.get_sites(i, numOfSavedSites, numOfSavedVariables)):
+                raise ValueError(f"x{i} is at sites {saved} in {path}, not at the sites given by the placement")
+
+    def start_site_processes(self):
+        """ Move every site to its own worker process, the data manager then talks to RemoteSite proxies. """
+        for name, site in list(self.sites.items()):
+            if not isinstance(site, RemoteSite):
+                self.sites[name] = RemoteSite(site)
+        for x in self.variableSites:
+            self._update_available_sites_of_variable(x)
+
+    def save_image(self, path):
+        """
+        Save committed values, commit ticks, placement and site statuses to a database image.
+
+        Parameters
+        -----------
+        path: str
+            Image file path
+        """
+        save_image(self, path)
+
+    def _update_available_sites_of_variable(self, x):
+        self.availableSitesOfVariable[x] = [self.sites[site] for site in self.variableSites[x] if self.sites[site].isActive]
+
+    def attach_waitList(self, waitLists):
+        """
+        Attach the wait list to wake up when locks are released or sites fail/recover.
+
+        Parameters
+        -----------
+        waitLists: WaitList object
+        """
+        self.waitLists = waitLists
+
+    def _wake_site(self, site, notified=None):
+        """
+        Wake up wait objects that wait on variables of a site, 
+        and wait objects of transactions notified to abort by this site.
+        """
+        if self.waitLists is None:
+            return
+        if notified is None:
+            notified = []
+        self.waitLists.wake_variables(site.committedVariables)
+        for t in notified:
+            self.waitLists.wake_transaction(t)
 
     def get_site_index(self, x): 
         """
@@ -57,13 +241,24 @@ class DataMgr(object):
         -----------
         None if x is on multiple sites; site index if x is not replicated 
         """
-        siteNum = int(re.split('(\d+)',x)[1]) % 10
-        # siteNum = int(x[x.find('.')+1:])
-        if siteNum % 2:
-            return str(siteNum+1)
+        sites = self.variableSites.get(x)
+        if sites and len(sites) == 1:
+            return sites[0]
 
         return None
 
+    def is_replicated(self, x):
+        """
+        Check if x is stored on more than one site.
+
+        Parameters
+        -----------
+        x: str
+            variable name
+
+        Returns: bool
+        """
+        return len(self.variableSites.get(x, ())) > 1
 
     def get_available_sites(self): 
         """
@@ -76,6 +271,21 @@ class DataMgr(object):
 
         return [site for site in self.sites.values() if site.isActive]
     
+    def get_touched_available_sites(self, transaction): 
+        """
+        Return sites that are up and were accessed by the transaction.
+
+        Parameters
+        -----------
+        transaction: Transaction Object
+
+        Returns: list
+        -----------
+        List of available sites.
+        """
+        sites = [self.sites[name] for name in transaction.get_touched_sites()]
+        return [site for site in sites if site.isActive]
+
     def get_available_sites_for_variable(self, x): 
         """
         Get all sites that is active and contain x.
@@ -85,23 +295,10 @@ class DataMgr(object):
             x: variable name
         Returns: list
         -----------
-        The list of sites that are up and contain x.
+        The list of sites that are up and contain x, kept up to date on failure and recovery; 
+        it should not be modified by the caller.
         """
-
-        # varNum = int(x[x.find('.')+1:])
-        siteIndex = self.get_site_index(x)
-        if siteIndex != None:
-            # odd variable only on one site
-            site=self.sites[siteIndex]
-            if site.isActive and site.ifContains(x):
-                return [site]
-            return []
-        
-        # even variable, can have multiple copies
-        availableSites = self.get_available_sites()
-        allSites = [site for site in availableSites if site.ifContains(x)]
-
-        return allSites
+        return self.availableSitesOfVariable.get(x, [])
 
     def recover(self, siteNum, tick):
         """
@@ -115,7 +312,10 @@ class DataMgr(object):
             current tick
         """
         self.sites[siteNum].recover(tick)
-        logger.debug(f"{tick}: Recovered Site {siteNum}")
+        for x in self.sites[siteNum].committedVariables:
+            self._update_available_sites_of_variable(x)
+        self._wake_site(self.sites[siteNum])
+        logger.debug("%s: Recovered Site %s", tick, siteNum)
 
     def fail(self, siteNum, tick):
         """
@@ -128,9 +328,25 @@ class DataMgr(object):
         tick: int
             current tick
         """
-        self.sites[siteNum].fail(tick)
-        logger.debug(f"{tick}: Failed Site {siteNum}")
+        notified = self.sites[siteNum].fail(tick)
+        for x in self.sites[siteNum].committedVariables:
+            self._update_available_sites_of_variable(x)
+        self._wake_site(self.sites[siteNum], notified)
+        logger.debug("%s: Failed Site %s", tick, siteNum)
     
+    def _count_read(self, site):
+        self.readCounts[site.name] = self.readCounts.get(site.name, 0) + 1
+
+    def get_read_counts(self):
+        """
+        Get the number of successful reads served by each site, to check how reads spread over the copies.
+
+        Returns: dict
+        -----------
+        Site name -> number of reads.
+        """
+        return {name: self.readCounts.get(name, 0) for name in self.sites}
+
     def request_read_only(self, transaction, x):
         """
         Request read only operation.
@@ -145,33 +361,35 @@ class DataMgr(object):
         -----------
         The value of variable x if read successfully; None otherwise
         """
-        logger.debug(f"{transaction.name} requests read only on variable {x}.")
+        logger.debug("%s requests read only on variable %s.", transaction.name, x)
         sites = self.get_available_sites_for_variable(x)
         if not sites:
             # no available site is up, need to wait if variable is not replicated
-            logger.debug(f"{transaction.name} fail to read only on variable {x}! No active sites.")
+            logger.debug("%s fail to read only on variable %s! No active sites.", transaction.name, x)
             return None
 
-        if self.get_site_index(x) != None:
-            # odd variable
+        if not self.is_replicated(x):
+            # not replicated variable
             var = sites[0].read_only(transaction, x)
-            logger.info(f"{transaction.name} reads on Site {sites[0].name} - "+ str(var))
+            self._count_read(sites[0])
+            logger.info("%s reads on Site %s - %s", transaction.name, sites[0].name, var)
             return var
         
         # Replicated variable
-        for site in sites:
-            # if site recovered after read only transaction begin, there should be no copies on that site
-            # if_available_to_read_only might be redundant 
+        for site in self.replicaSelection.order(sites, x):
+            # the site must have been up when the read only transaction began, 
+            # and committed x after its last recovery before that
             if site.if_available_to_read_only(transaction, x):
-                # read the first available  
+                # read the first available in the order of the replica selection policy
                 var = site.read_only(transaction, x)
-                logger.info(f"{transaction.name} reads on Site {site.name} - "+ str(var))
+                self._count_read(site)
+                logger.info("%s reads on Site %s - %s", transaction.name, site.name, var)
                 return var
 
-        logger.debug(f"{transaction.name} fail to read only on variable {x}! Can't be read on sites {sites}.")
+        logger.debug("%s fail to read only on variable %s! Can't be read on sites %s.", transaction.name, x, sites)
         return None
 
-    def request_read(self, transaction, x, tick):
+    def request_read(self, transaction, x, tick, takeLock=True):
         """
         Request read operation.
 
@@ -182,6 +400,8 @@ class DataMgr(object):
             Variable name 
         tick: int
             current tick
+        takeLock: bool
+            If False, read without a read lock, for optimistic concurrency control
 
         Returns: tuple (bool, list/str)
         -----------
@@ -190,28 +410,33 @@ class DataMgr(object):
         if read fail, it is the a list of lock objects blocking this read.
         """
 
-        logger.debug(f"{transaction.name} requests read on variable {x}.")
+        logger.debug("%s requests read on variable %s.", transaction.name, x)
         sites = self.get_available_sites_for_variable(x)
         if not sites:
             # All sites 
-            logger.debug(f"{transaction.name} fail to read on variable {x}! No active sites.")
+            logger.debug("%s fail to read on variable %s! No active sites.", transaction.name, x)
             return (False, [])
 
         blocked = []
+        isReplicated = self.is_replicated(x)
+        if isReplicated:
+            sites = self.replicaSelection.order(sites, x)
         for site in sites:
-            if self.get_site_index(x) != None or site.if_available_to_read(transaction, x):
+            if not isReplicated or site.if_available_to_read(transaction, x):
                 # for not replicated variable, no need the check the commit time(if_available_to_read)
-                blocked = site.lock_variable(transaction, x, LockState.R_LOCK, tick)
+                if takeLock:
+                    blocked = site.lock_variable(transaction, x, LockState.R_LOCK, tick)
                 if not blocked:
                     var = site.read(transaction, x)
-                    logger.info(f"{transaction.name} reads on Site {site.name} - "+ str(var))
+                    self._count_read(site)
+                    logger.info("%s reads on Site %s - %s", transaction.name, site.name, var)
 
                     return (True, var)
                 
-        logger.debug(f"{transaction.name} fail to read on variable {x}! Can't be read on sites {sites}.")
+        logger.debug("%s fail to read on variable %s! Can't be read on sites %s.", transaction.name, x, sites)
         return (False, blocked)
 
-    def request_write(self, transaction, x, val, tick):
+    def request_write(self, transaction, x, val, tick, takeLock=True):
         """
         Request write operation.
 
@@ -220,10 +445,12 @@ class DataMgr(object):
         transaction: Transaction Object
 		x: str
             Variable name
-        val: str
+        val: int
             The value to write
         tick: int
             Current tick
+        takeLock: bool
+            If False, only buffer the write on the sites, for optimistic concurrency control
 
         Returns: tuple (bool, list)
         -----------
@@ -231,34 +458,288 @@ class DataMgr(object):
         For Second element, if write success, it is a empty list;
         if write fail, it is the a list of lock objects blocking this write.
         """
-        logger.debug(f"{transaction.name} requests write on variable {x}: {val}.")
+        logger.debug("%s requests write on variable %s: %s.", transaction.name, x, val)
         sites = self.get_available_sites_for_variable(x)
         if not sites:
-            logger.debug(f"{transaction.name} fail to write on variable {x}! No active sites.")
+            logger.debug("%s fail to write on variable %s! No active sites.", transaction.name, x)
             return (False, [])
 
+        if not takeLock:
+            call_sites(sites, [("write", [transaction, x, val])])
+            return (True, [])
+
+        # each site checks and grants the write lock in one step
         blocked = []
-        sitesNotBlock = []
-        for site in sites:
-            blockedBy = site.get_rw_lock_block(transaction, x)
+        reserved = []
+        for site, ((blockedBy, priorLock),) in zip(sites, call_sites(sites, [("reserve_rw_lock", [transaction, x, tick])])):
             blocked += blockedBy
             if not blockedBy:
-                sitesNotBlock.append(site)
+                reserved.append((site, [("cancel_rw_lock_reservation", [transaction, x, priorLock, True])]))
 
         if blocked:
-            # notify line up
-            for site in sitesNotBlock:
-                site.lock_lining_up(transaction, x)
+            # can't require write lock on all sites, 
+            # give back the locks granted on the other sites and line up there instead
+            call_each_site(reserved)
+            return (False, blocked)
 
-            # can't require write lock on all sites
+        call_sites(sites, [("write", [transaction, x, val])])
+        return (True, [])
+
+    def _get_lock_order(self, variables):
+        """ Variables without duplicates, in the order locks are taken: x1, x2, ..., x10, ... """
+        return sorted(dict.fromkeys(variables), key=lambda x: (len(x), x))
+
+    def _in_site_order(self, siteCalls):
+        """ List the (site, calls) tuples of a dict keyed by site name in site order. """
+        return [siteCalls[name] for name in self.sites if name in siteCalls]
+
+    def request_read_batch(self, transaction, variables, tick):
+        """
+        Request read operations on several variables. The read locks of all variables are 
+        checked on every site in one pass, and only taken if all of them can be taken, 
+        so the batch blocks as a unit.
+
+        Parameters
+        -----------
+        transaction: Transaction Object
+        variables: list
+            Variable names
+        tick: int
+            current tick
+
+        Returns: tuple (bool, list)
+        -----------
+        First element is the boolean showing whether all reads successfully processed.
+        For Second element, if read success, it is the list of read values in lock order;
+        if read fail, it is the a list of lock objects blocking this read.
+        """
+        variables = self._get_lock_order(variables)
+        logger.debug("%s requests read on variables %s.", transaction.name, variables)
+
+        # variable name -> (sites in the order they are tried, if replicated)
+        candidates = {}
+        # site name -> (site, calls), so each site checks all its variables at once
+        siteCalls = {}
+        for x in variables:
+            sites = self.get_available_sites_for_variable(x)
+            isReplicated = self.is_replicated(x)
+            if isReplicated and sites:
+                sites = self.replicaSelection.order(sites, x)
+            candidates[x] = (sites, isReplicated)
+            for site in sites:
+                calls = siteCalls.setdefault(site.name, (site, []))[1]
+                if isReplicated:
+                    calls.append(("if_available_to_read", [transaction, x]))
+                calls.append(("get_r_lock_block", [transaction, x]))
+        checks = self._in_site_order(siteCalls)
+        results = {site.name: iter(siteResults) for (site, _), siteResults in zip(checks, call_each_site(checks))}
+
+        plan = []
+        blocked = []
+        ready = True
+        for x in variables:
+            sites, isReplicated = candidates[x]
+            chosen = None
+            blockedBy = []
+            for site in sites:
+                # results come back in the order the calls were added
+                available = next(results[site.name]) if isReplicated else True
+                lockBlock = next(results[site.name])
+                if chosen is None and available:
+                    blockedBy = lockBlock
+                    if not lockBlock:
+                        chosen = site
+            if chosen is None:
+                logger.debug("%s fail to read on variable %s! Can't be read on sites %s.", transaction.name, x, sites)
+                ready = False
+                blocked += blockedBy
+            else:
+                plan.append((x, chosen))
+        if not ready:
             return (False, blocked)
 
-        for site in sites:
-            site.lock_variable(transaction, x, LockState.RW_LOCK, tick)
-            site.write(transaction, x, val)
+        siteCalls = {}
+        for x, site in plan:
+            siteCalls.setdefault(site.name, (site, []))[1].extend(
+                [("lock_variable", [transaction, x, LockState.R_LOCK, tick]), ("read", [transaction, x])])
+        reads = self._in_site_order(siteCalls)
+        values = {}
+        for (_, calls), siteResults in zip(reads, call_each_site(reads)):
+            for (method, args), result in zip(calls, siteResults):
+                if method == "read":
+                    values[args[1]] = result
+
+        for x, site in plan:
+            self._count_read(site)
+            logger.info("%s reads on Site %s - %s", transaction.name, site.name, values[x])
+        return (True, [values[x] for x in variables])
+
+    def request_write_batch(self, transaction, writes, tick):
+        """
+        Request write operations on several variables. The write locks of all variables are 
+        reserved on every site in one pass, and given back if any of them can't be taken, 
+        so the batch blocks as a unit. When blocked, the transaction lines up on the sites 
+        not blocking a variable, like a single write.
 
+        Parameters
+        -----------
+        transaction: Transaction Object
+        writes: dict
+            Variable name -> value to write
+        tick: int
+            Current tick
+
+        Returns: tuple (bool, list)
+        -----------
+        First element is the boolean showing whether all writes successfully processed.
+        For Second element, if write success, it is a empty list;
+        if write fail, it is the a list of lock objects blocking this write.
+        """
+        variables = self._get_lock_order(writes)
+        logger.debug("%s requests write on variables %s.", transaction.name, writes)
+
+        # variable name -> up sites storing it
+        sitesOf = {}
+        siteCalls = {}
+        for x in variables:
+            sitesOf[x] = self.get_available_sites_for_variable(x)
+            for site in sitesOf[x]:
+                siteCalls.setdefault(site.name, (site, []))[1].append(("reserve_rw_lock", [transaction, x, tick]))
+        checks = self._in_site_order(siteCalls)
+        results = {site.name: iter(siteResults) for (site, _), siteResults in zip(checks, call_each_site(checks))}
+
+        blocked = []
+        ready = True
+        # variable name -> (site, lock held before) of the granted reservations
+        reserved = {}
+        for x in variables:
+            if not sitesOf[x]:
+                logger.debug("%s fail to write on variable %s! No active sites.", transaction.name, x)
+                ready = False
+            reserved[x] = []
+            for site in sitesOf[x]:
+                blockedBy, priorLock = next(results[site.name])
+                blocked += blockedBy
+                if not blockedBy:
+                    reserved[x].append((site, priorLock))
+            if len(reserved[x]) < len(sitesOf[x]):
+                ready = False
+        if not ready:
+            # give back the reservations, and line up on the sites not blocking a blocked variable
+            cancels = {}
+            for x in variables:
+                lineUp = len(reserved[x]) < len(sitesOf[x])
+                for site, priorLock in reserved[x]:
+                    cancels.setdefault(site.name, (site, []))[1].append(
+                        ("cancel_rw_lock_reservation", [transaction, x, priorLock, lineUp]))
+            call_each_site(self._in_site_order(cancels))
+            return (False, blocked)
+
+        siteCalls = {}
+        for x in variables:
+            for site in sitesOf[x]:
+                siteCalls.setdefault(site.name, (site, []))[1].append(("write", [transaction, x, writes[x]]))
+        call_each_site(self._in_site_order(siteCalls))
         return (True, [])
 
+    def get_latest_commit_times(self, variables):
+        """
+        Get the commit tick of the latest version of each variable on the sites that are up,
+        asking each site once.
+
+        Parameters
+        -----------
+        variables: iterable
+            Variable names
+
+        Returns: dict
+        -----------
+        Variable name -> latest commit tick; variables without a site up are left out.
+        """
+        siteVariables = {}
+        for x in variables:
+            for site in self.get_available_sites_for_variable(x):
+                siteVariables.setdefault(site.name, (site, []))[1].append(x)
+        siteCalls = [(site, [("get_last_committed_times", [xs])]) for site, xs in self._in_site_order(siteVariables)]
+
+        latest = {}
+        for (site, _), (ticks,) in zip(siteCalls, call_each_site(siteCalls)):
+            for x, tick in zip(siteVariables[site.name][1], ticks):
+                latest[x] = max(latest.get(x, tick), tick)
+        return latest
+
+    def set_snapshot_watermark(self, watermark):
+        """
+        Let every site drop committed versions older than the oldest active read only transaction.
+
+        Parameters
+        -----------
+        watermark: int
+            Start time of the oldest active read only transaction; None if there is none.
+        """
+        previous = self.snapshotWatermark
+        if watermark == previous:
+            return
+        self.snapshotWatermark = watermark
+        if previous is None:
+            # no site keeps older versions yet, each site gets the watermark with its next commit
+            return
+
+        # the watermark advanced, only sites that may keep older versions have some to drop
+        sites = [site for name, site in self.sites.items() if name in self.sitesWithVersions]
+        for site, (kept,) in zip(sites, call_sites(sites, [("trim_versions", [watermark])])):
+            self.siteWatermarks[site.name] = watermark
+            if not kept:
+                self.sitesWithVersions.discard(site.name)
+
+    def _get_watermark_calls(self, site):
+        """
+        Get the calls to run on a site before committing on it: tell it the snapshot watermark
+        if it has not got the current one yet, so it keeps the versions read only transactions can see.
+
+        Returns: list
+        -----------
+        List of (method name, args) tuples.
+        """
+        if self.snapshotWatermark is not None:
+            self.sitesWithVersions.add(site.name)
+        if self.siteWatermarks.get(site.name) == self.snapshotWatermark:
+            return []
+        self.siteWatermarks[site.name] = self.snapshotWatermark
+        return [("trim_versions", [self.snapshotWatermark])]
+
+    def get_retained_version_counts(self, peak=False):
+        """
+        Get the number of committed versions kept on each site, for monitoring.
+
+        Parameters
+        -----------
+        peak: bool
+            If the largest number kept at once since the start is returned instead of the current one
+
+        Returns: dict
+        -----------
+        Site name -> number of versions.
+        """
+        results = call_sites(list(self.sites.values()), [("get_retained_version_count", [peak])])
+        return {name: count for name, (count,) in zip(self.sites, results)}
+
+    def get_lock_table_sizes(self, peak=False):
+        """
+        Get the number of lock table entries on each site, for monitoring.
+
+        Parameters
+        -----------
+        peak: bool
+            If the largest number at once since the start is returned instead of the current one
+
+        Returns: dict
+        -----------
+        Site name -> number of lock table entries.
+        """
+        results = call_sites(list(self.sites.values()), [("get_lock_table_size", [peak])])
+        return {name: size for name, (size,) in zip(self.sites, results)}
+
     def abort_on_all_sites(self, transaction):
         """
         Request to abort transaction.
@@ -268,11 +749,15 @@ class DataMgr(object):
         transaction: transaction object
         """
 
-        logger.debug(f"Abort {transaction.name} on all sites.")
+        logger.debug("Abort %s on all sites.", transaction.name)
 
-        sites = self.get_available_sites()
-        for site in sites:
-            site.abort(transaction)
+        sites = self.get_touched_available_sites(transaction)
+        for (touched,) in call_sites(sites, [("abort", [transaction])]):
+            if self.waitLists is not None:
+                self.waitLists.wake_variables(touched)
+
+        if self.waitLists is not None:
+            self.waitLists.wake_blocked_by(transaction)
 
     def commit_on_all_sites(self, transaction, tick):
         """
@@ -285,29 +770,82 @@ class DataMgr(object):
             Current tick
         """
 
-        logger.debug(f"Commit {transaction.name} on all sites.")
+        logger.debug("Commit %s on all sites.", transaction.name)
 
-        sites = self.get_available_sites()
-        for site in sites:
-            site.commit(transaction, tick)
+        sites = self.get_touched_available_sites(transaction)
+        # the WAL of each site is synced once for all writes committed in this tick
+        siteCalls = [(site, self._get_watermark_calls(site) + [("commit", [transaction, tick]), ("sync_log", [])]) for site in sites]
+        for results in call_each_site(siteCalls):
+            if self.waitLists is not None:
+                self.waitLists.wake_variables(results[-2])
+
+        if self.waitLists is not None:
+            self.waitLists.wake_blocked_by(transaction)
+
+    def group_commit_on_all_sites(self, commits):
+        """
+        Request to commit a group of transactions. Each site gets one batch with the commits
+        of the group that touched it, in order, and syncs its WAL once for the whole group;
+        waiters are woken once for all of them.
+
+        Parameters
+        -----------
+        commits: list
+            List of (transaction object, commit tick) tuples
+        """
+
+        logger.debug("Group commit %s on all sites.", [transaction.name for transaction, _ in commits])
+
+        # site name -> (site, commit calls)
+        siteCommits = {}
+        for transaction, tick in commits:
+            for site in self.get_touched_available_sites(transaction):
+                siteCommits.setdefault(site.name, (site, []))[1].append(("commit", [transaction, tick]))
+        siteCalls = [(site, self._get_watermark_calls(site) + calls + [("sync_log", [])]) for site, calls in siteCommits.values()]
+
+        touchedVariables = set()
+        for (_, calls), results in zip(siteCalls, call_each_site(siteCalls)):
+            for (method, _), touched in zip(calls, results):
+                if method == "commit":
+                    touchedVariables.update(touched)
+
+        if self.waitLists is not None:
+            self.waitLists.wake_variables(touchedVariables)
+            for transaction, _ in commits:
+                self.waitLists.wake_blocked_by(transaction)
+
+    def forget_transaction(self, transaction):
+        """
+        Let the site processes drop their copy of a transaction that committed or aborted, 
+        including read only transactions and transactions that only checked locks on a site.
+
+        Parameters
+        -----------
+        transaction: transaction object
+        """
+        for site in self.sites.values():
+            if isinstance(site, RemoteSite):
+                site.forget(transaction)
+
+    def close(self):
+        """ Close the write-ahead logs in durable mode and stop the site processes. """
+        for site in self.sites.values():
+            if isinstance(site, RemoteSite):
+                site.close()
+            elif site.log is not None:
+                site.log.close()
 
     def dump_var(self, varName):
         for name, site in self.sites.items():
             if varName in site.committedVariables:
-                var = f'Site {name} - '+ str(site.committedVariables[varName])
+                var = f'Site {name} - '+ str(site.get_committed(varName))
                 logger.info(var)
 
 
     def dump_all_sites(self):
         """ dump """
         for name, site in self.sites.items():
-            variables = list(site.committedVariables.keys())
-            num = sorted([int(v[1:]) for v in variables])
-            sortedVars = ['x'+ str(n) for n in num]
-
-            strVars = f"Site {name} - "
-            for v in sortedVars:
-                strVars += str(site.committedVariables[v]) + ", "
-
-            logger.info(strVars[:-2])
+            # sites store variables ordered by index
+            strVars = ", ".join(str(site.get_committed(v)) for v in site.committedVariables)
+            logger.info("Site %s - %s", name, strVars)
 
@@ -0,0 +1,133 @@
+"""
+Script that contains the policies deciding when the executor runs deadlock detection.
+
+A new cycle in the waits-for graph always contains a wait object added since the last
+detection, so the periodic, threshold and timeout triggers only run detection if some wait
+object is unchecked, and trade the delay until a deadlock is broken for fewer detections.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+from const import ResultType
+
+class DetectionTrigger(object):
+    def __init__(self) -> None:
+        # wait objects with a smaller seq were in the wait list at the last detection
+        self.checkedSeq = 0
+        self.lastDetection = 0
+
+    def should_detect(self, tick, lastResult, waitList):
+        """
+        Decide if deadlock detection runs before the next operation.
+
+        Parameters
+        -----------
+        tick: int
+            Current tick
+        lastResult: ResultType Enum
+            Result of the last executed operation
+        waitList: WaitList object
+
+        Returns: bool
+        """
+        raise NotImplementedError
+
+    def get_oldest_unchecked(self, waitList):
+        """
+        Get the oldest wait object added since the last detection.
+
+        Returns: WaitObj
+        -----------
+        The wait object; None if there is none.
+        """
+        return waitList.get_oldest_since(self.checkedSeq)
+
+    def has_unchecked(self, waitList):
+        return waitList.nextSeq > self.checkedSeq
+
+    def detected(self, tick, waitList):
+        """
+        Record that deadlock detection ran.
+
+        Returns: int
+        -----------
+        Ticks the oldest wait object added since the last detection waited for it; None if there is none.
+        """
+        oldest = self.get_oldest_unchecked(waitList)
+        self.checkedSeq = waitList.nextSeq
+        self.lastDetection = tick
+        return tick - oldest.addedTick if oldest is not None and oldest.addedTick is not None else None
+
+class OnBlockTrigger(DetectionTrigger):
+    """
+    Detect after every operation that gets blocked.
+    """
+    def should_detect(self, tick, lastResult, waitList):
+        return lastResult == ResultType.WL
+
+class PeriodicTrigger(DetectionTrigger):
+    """
+    Detect at most once every `interval` ticks.
+    """
+    def __init__(self, interval) -> None:
+        super().__init__()
+        self.interval = interval
+
+    def should_detect(self, tick, lastResult, waitList):
+        return self.has_unchecked(waitList) and tick - self.lastDetection >= self.interval
+
+class ThresholdTrigger(DetectionTrigger):
+    """
+    Detect when the wait list holds at least `size` wait objects.
+    """
+    def __init__(self, size) -> None:
+        super().__init__()
+        self.size = size
+
+    def should_detect(self, tick, lastResult, waitList):
+        return self.has_unchecked(waitList) and waitList.get_size() >= self.size
+
+class TimeoutTrigger(DetectionTrigger):
+    """
+    Detect when a wait object added since the last detection has waited for `timeout` ticks.
+    """
+    def __init__(self, timeout) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def should_detect(self, tick, lastResult, waitList):
+        if not self.has_unchecked(waitList):
+            return False
+        oldest = self.get_oldest_unchecked(waitList)
+        return oldest is not None and tick - oldest.addedTick >= self.timeout
+
+DETECTION_TRIGGERS = {
+    "onBlock": OnBlockTrigger,
+    "periodic": PeriodicTrigger,
+    "threshold": ThresholdTrigger,
+    "timeout": TimeoutTrigger,
+}
+
+def get_detection_trigger(name, value=None):
+    """
+    Create a detection trigger by name.
+
+    Parameters
+    -----------
+    name: str
+        One of the keys of DETECTION_TRIGGERS
+    value: int
+        Interval in ticks, wait list size or timeout in ticks, not used by the onBlock trigger
+
+    Returns: DetectionTrigger
+    """
+    if name not in DETECTION_TRIGGERS:
+        raise ValueError(f"Unknown detection trigger {name}, should be one of {list(DETECTION_TRIGGERS)}")
+    if name == "onBlock":
+        return OnBlockTrigger()
+    if value is None or value < 1:
+        raise ValueError(f"Detection trigger {name} needs a positive value")
+    return DETECTION_TRIGGERS[name](value)
@@ -0,0 +1,105 @@
+"""
+Script that contains the functions to save and load a database image of the data manager.
+
+An image is a single file: a magic number, the length of a JSON header, the JSON header
+(site statuses and the offsets of the arrays) and the binary arrays (variable placement,
+then the variable indexes, committed values, commit ticks and replication flags of each site).
+Loading maps the file and copies each array in one bulk read.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+from array import array
+import json
+import mmap
+import struct
+
+IMAGE_MAGIC = b'RCIM'
+IMAGE_PREFIX = struct.Struct('<4sq')
+
+def save_image(dataMgr, path):
+    """
+    Save the committed values, commit ticks, placement and site statuses of a data manager.
+    Locks, uncommitted writes and versions kept for read only transactions are not saved.
+
+    Parameters
+    -----------
+    dataMgr: DataMgr object
+    path: str
+        Image file path
+    """
+    blobs = []
+    offset = 0
+    def add(arr):
+        nonlocal offset
+        data = arr.tobytes()
+        blobs.append(data)
+        entry = {"offset": offset, "typecode": arr.typecode, "length": len(arr)}
+        offset += len(data)
+        return entry
+
+    # variables are named x<index>
+    variables = list(dataMgr.variableSites)
+    header = {
+        "variableIndexes": add(array('q', (int(x[1:]) for x in variables))),
+        "siteCounts": add(array('q', (len(dataMgr.variableSites[x]) for x in variables))),
+        "sites": add(array('q', (int(site) for x in variables for site in dataMgr.variableSites[x]))),
+        "siteStates": [],
+    }
+    for name, site in dataMgr.sites.items():
+        store = site.committedVariables
+        header["siteStates"].append({
+            "name": name,
+            "isActive": site.isActive,
+            "recoveredTime": site.recoveredTime,
+            "statusTimes": site.statusTimes,
+            "statusHistory": site.statusHistory,
+            "variableIndexes": add(array('q', (int(x[1:]) for x in store.names))),
+            "values": add(store.values),
+            "commitTimes": add(store.commitTimes),
+            "replicated": add(store.replicated),
+        })
+
+    headerBytes = json.dumps(header).encode()
+    with open(path, 'wb') as image:
+        image.write(IMAGE_PREFIX.pack(IMAGE_MAGIC, len(headerBytes)))
+        image.write(headerBytes)
+        for data in blobs:
+            image.write(data)
+
+def read_image(path):
+    """
+    Read an image saved by `save_image`.
+
+    Parameters
+    -----------
+    path: str
+        Image file path
+
+    Returns: dict
+    -----------
+    The JSON header, where every array entry is replaced by the loaded array.
+    """
+    with open(path, 'rb') as image:
+        with mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, headerLength = IMAGE_PREFIX.unpack_from(mm, 0)
+            if magic != IMAGE_MAGIC:
+                raise ValueError(f"{path} is not a database image!")
+            start = IMAGE_PREFIX.size + headerLength
+            header = json.loads(mm[IMAGE_PREFIX.size:start])
+
+            def load(entry):
+                arr = array(entry["typecode"])
+                begin = start + entry["offset"]
+                arr.frombytes(mm[begin:begin + entry["length"] * arr.itemsize])
+                return arr
+
+            for key in ("variableIndexes", "siteCounts", "sites"):
+                header[key] = load(header[key])
+            for state in header["siteStates"]:
+                for key in ("variableIndexes", "values", "commitTimes", "replicated"):
+                    state[key] = load(state[key])
+    return header
@@ -17,6 +17,8 @@ Typical usage example (run a single input test):
         --testFile <PathToTestFile>  \
         --stdout  # remove this arg to not printing out the results
 
+Pass `--testFile -` to read operations from stdin (e.g. piped from a trace generator).
+
 @Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
 @Date: Dec/03/2022
 @Instructor: Prof. Dennis Shasha
@@ -25,9 +27,17 @@ Typical usage example (run a single input test):
 
 from data_mgr import DataMgr
 from transaction_mgr import TransactionMgr
-from const import NUM_OF_SITES, NUM_OF_VARIABLES, OperationType, ResultType
+from placement import PLACEMENTS, get_placement
+from replica_selection import REPLICA_SELECTIONS, get_replica_selection
+from detection_trigger import DETECTION_TRIGGERS, OnBlockTrigger, get_detection_trigger
+from metrics import Metrics
+from const import NUM_OF_SITES, NUM_OF_VARIABLES, AbortReason, ConcurrencyControl, DeadlockPolicy, OperationType, ResultType
 import argparse
 import logging
+import logging.handlers
+import queue
+import sys
+import time
 from pathlib import Path
 import utils as utils
 
@@ -37,123 +47,416 @@ class SpecialFormatter(logging.Formatter):
     FORMATS = { logging.INFO: "%(message)s",
                'DEFAULT': '%(levelname)s: [%(module)s] %(message)s'}
 
+    def __init__(self):
+        super().__init__()
+        # build one formatter per format instead of one per record
+        self.formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno, self.FORMATS['DEFAULT'])
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno, self.formatters['DEFAULT'])
         return formatter.format(record)
 
+def _parse_value(val):
+    """ Parse a write value as an int; a malformed value is kept as is and rejected by the executor. """
+    try:
+        return int(val)
+    except ValueError:
+        return val
+
+def parse_lines(lines):
+    """
+    Parse input lines into operations lazily.
+
+    Parameters
+    -----------
+    lines: iterable
+        Iterable of input lines, e.g. an opened file or sys.stdin
+
+    Returns: generator
+    -----------
+    Generator of (operation, vars) tuples, one per operation line. 
+    A batch read has the list of variables as second element, a batch write the dict of values.
+    Write values are parsed as ints.
+    Comments and lines without an operation are skipped.
+    """
+    for line in lines:
+        if line.startswith("//"):
+            continue
+
+        openB = line.find('(')
+        closeB = line.find(')', openB+1)
+        if openB < 0 or closeB < 0:
+            continue
+
+        operation = line[:openB].strip()
+        body = line[openB+1:closeB]
+        if operation == OperationType.WRITE and '{' in body:
+            # batch write W(T, {x1: v1, x2: v2, ...})
+            t, _, mapping = body.partition(',')
+            writes = {}
+            for pair in mapping.strip().strip('{}').split(','):
+                x, _, val = pair.partition(':')
+                writes[x.strip()] = _parse_value(val.strip())
+            yield (OperationType.BATCH_WRITE, [t.strip(), writes])
+            continue
+
+        vars = [v.strip() for v in body.split(',')]
+        if operation == OperationType.READ and len(vars) > 2:
+            # batch read R(T, x1, x2, ...)
+            yield (OperationType.BATCH_READ, [vars[0], vars[1:]])
+            continue
+        if operation == OperationType.WRITE and len(vars) == 3:
+            vars[2] = _parse_value(vars[2])
+        yield (operation, vars)
+
 def process_input(file):
-    executions = []
+    """
+    Stream operations from a test file, or from stdin if file is '-'.
+
+    Parameters
+    -----------
+    file: str
+        Path to the input file, or '-' for stdin
+
+    Returns: generator
+    -----------
+    Generator of (operation, vars) tuples.
+    """
+    if file == '-':
+        yield from parse_lines(sys.stdin)
+        return
+
     with open(file) as input:
-        for line in input:
-            if line.startswith("//") or not line.find('(') or not line.find(')'):
-                continue
-
-            openB = line.find('(')
-            closeB = line.find(')')
-            operation = line[:openB]
-            vars = [v.strip() for v in line[openB+1:closeB].split(',')]
-            executions.append((operation, vars))
-
-    return executions
-
-def run(executions, dataMgr, transMgr):
-    operations = {
-        # add new operation function to this dict
-        "begin": transMgr.start_transaction,
-        "beginRO": transMgr.start_RO_transaction,
-        "fail": dataMgr.fail,
-        "recover": dataMgr.recover,
-        OperationType.READ: transMgr.read,
-        OperationType.WRITE: transMgr.write,
-        "end": transMgr.end,
-        "dump": transMgr.dump,
+        yield from parse_lines(input)
+
+class Executor(object):
+    # number of arguments of each operation, dump takes an optional variable
+    ARGUMENT_COUNTS = {
+        "begin": 1,
+        "beginRO": 1,
+        "fail": 1,
+        "recover": 1,
+        OperationType.READ: 2,
+        OperationType.WRITE: 3,
+        OperationType.BATCH_READ: 2,
+        OperationType.BATCH_WRITE: 2,
+        "end": 1,
     }
 
-    tick = 0
-    lastResult = None
-    for exe in executions:
-        if lastResult == ResultType.WL:
-            logger.debug(f"{tick}: Detecting deadlock...")
-            youngest = transMgr.waitLists.deadlock_detection()
-            while youngest:
-                for t in youngest:
-                    # young die
-                    # youngest = transMgr.waitLists.get_youngest_transaction()
-                    transMgr.abort(t, tick)
-                youngest = transMgr.waitLists.deadlock_detection()
-
-        # multiple executing wait list
-        executingWL = True
-        while executingWL:
-            executingWL = False
-            for waitObj in list(transMgr.waitLists.get_waitList()):
-                logger.debug(f"{tick}: Trying to execute {str(waitObj)} from wait list...")
+    def __init__(self, dataMgr, transMgr, detectionTrigger=None) -> None:
+        """
+        Initialize Executor, which executes operations one at a time and keeps the tick.
+
+        Parameters
+        -----------
+        dataMgr: DataMgr object
+        transMgr: TransactionMgr object
+        detectionTrigger: DetectionTrigger
+            Policy deciding when deadlock detection runs, OnBlockTrigger if None.
+        """
+        self.dataMgr = dataMgr
+        self.transMgr = transMgr
+        self.detectionTrigger = detectionTrigger if detectionTrigger is not None else OnBlockTrigger()
+        self.operations = {
+            # add new operation function to this dict
+            "begin": transMgr.start_transaction,
+            "beginRO": transMgr.start_RO_transaction,
+            "fail": dataMgr.fail,
+            "recover": dataMgr.recover,
+            OperationType.READ: transMgr.read,
+            OperationType.WRITE: transMgr.write,
+            OperationType.BATCH_READ: transMgr.read_batch,
+            OperationType.BATCH_WRITE: transMgr.write_batch,
+            "end": transMgr.end,
+            "dump": transMgr.dump,
+        }
+        # metrics are only collected if enabled on the transaction manager
+        self.metrics = transMgr.metrics
+
+        self.tick = 0
+        self.lastResult = None
+        # name of the transaction whose operation is being executed, None for fail, recover and dump
+        self.current = None
+
+    def settle(self):
+        """
+        Resolve deadlocks when the detection trigger fires (only under deadlock detection, 
+        the prevention policies abort when blocking), then retry the wait objects woken up by a commit, abort, failure or recovery.
+        """
+        transMgr = self.transMgr
+        metrics = self.metrics
+        waitLists = transMgr.waitLists
+        if waitLists.deadlockPolicy == DeadlockPolicy.DETECTION and \
+                self.detectionTrigger.should_detect(self.tick, self.lastResult, waitLists):
+            logger.debug("%s: Detecting deadlock...", self.tick)
+            if metrics is not None:
+                start = time.perf_counter()
+            youngest = waitLists.deadlock_detection()
+            delayTicks = self.detectionTrigger.detected(self.tick, waitLists)
+            if metrics is not None:
+                metrics.record_detection(time.perf_counter() - start, len(youngest), delayTicks)
+            for t in youngest:
+                # young die
+                self.current = t.name
+                transMgr.abort(t, self.tick, AbortReason.DEADLOCK)
+
+        # only retry wait objects woken up by a commit, abort, failure or recovery
+        woken = transMgr.waitLists.pop_woken()
+        while woken:
+            if metrics is not None:
+                metrics.waitListRescans += 1
+                metrics.waitListRetries += len(woken)
+            for waitObj in woken:
+                logger.debug("%s: Trying to execute %s from wait list...", self.tick, waitObj)
                 opName, args = waitObj.operation
-                if opName not in operations:
+                if opName not in self.operations:
                     continue
-                op = operations[opName]
+                op = self.operations[opName]
 
-                nerArgs = args + [tick]
+                self.current = waitObj.t.name
+                nerArgs = args + [self.tick]
                 result = op(*nerArgs)
                 if result == ResultType.WL:
                     # keep the original wait object
-                    logger.debug(f"{tick}: Failed to execute {str(waitObj)} from wait list")
-                    # transMgr.waitLists.remove_last_from_waitList()
+                    logger.debug("%s: Failed to execute %s from wait list", self.tick, waitObj)
                 else:
-                    logger.debug(f"{tick}: Executed {str(waitObj)} from wait list")
-                    lastResult = result
+                    logger.debug("%s: Executed %s from wait list", self.tick, waitObj)
+                    self.lastResult = result
                     transMgr.waitLists.remove_from_waitList(waitObj)
-                    tick += 1
-                    executingWL = True
-
-        # stop after successful execute one operation from wait list
-        # for waitObj in list(transMgr.waitLists.get_waitList()):
-        #     logger.debug(f"{tick}: Trying to execute {str(waitObj)} from wait list...")
-        #     opName, args = waitObj.operation
-        #     if opName not in operations:
-        #         continue
-        #     op = operations[opName]
-
-        #     nerArgs = args + [tick]
-        #     result = op(*nerArgs)
-        #     if result == ResultType.WL:
-        #         # keep the original wait object
-        #         logger.debug(f"{tick}: Failed to execute {str(waitObj)} from wait list")
-        #         # transMgr.waitLists.remove_last_from_waitList()
-        #     else:
-        #         logger.debug(f"{tick}: Executed {str(waitObj)} from wait list")
-        #         lastResult = result
-        #         transMgr.waitLists.remove_from_waitList(waitObj)
-        #         tick += 1
-        #         break
-
-        opName, args = exe
-        if opName not in operations:
-            continue
-        op = operations[opName]
+                    self.tick += 1
+            woken = transMgr.waitLists.pop_woken()
+
+    def check_operation(self, opName, args):
+        """
+        Check the arguments of an operation before it is executed.
+
+        Parameters
+        -----------
+        opName: str
+            Operation name
+        args: list
+            Operation arguments
+
+        Returns: str
+        -----------
+        Why the operation is rejected, None if it can be executed.
+        """
+        if opName not in self.operations:
+            return f"unknown operation {opName}"
+        if opName == "dump":
+            return None if len(args) <= 1 else "dump takes at most one variable"
+        name = opName.value if isinstance(opName, OperationType) else opName
+        if len(args) != self.ARGUMENT_COUNTS[opName]:
+            return f"{name} takes {self.ARGUMENT_COUNTS[opName]} arguments, got {len(args)}"
+        if opName in ("fail", "recover"):
+            return None if args[0] in self.dataMgr.sites else f"unknown site {args[0]}"
+        if not args[0]:
+            return "missing transaction name"
+        if opName in ("begin", "beginRO") and args[0] in self.transMgr.transactions \
+                and args[0] not in self.transMgr.pendingCommits:
+            # a transaction of the commit group is committed before the begin
+            return f"transaction {args[0]} is already active"
+        if opName in (OperationType.WRITE, OperationType.BATCH_WRITE):
+            transaction = self.transMgr.transactions.get(args[0])
+            if transaction is not None and transaction.readOnly:
+                return f"read only transaction {args[0]} cannot write"
+
+        variables, values = [], []
+        if opName in (OperationType.READ, OperationType.WRITE):
+            variables = [args[1]]
+            values = args[2:]
+        elif opName == OperationType.BATCH_READ:
+            variables = args[1]
+        elif opName == OperationType.BATCH_WRITE:
+            variables = list(args[1])
+            values = list(args[1].values())
+        for x in variables:
+            if x not in self.dataMgr.variableSites:
+                return f"unknown variable {x}"
+        for val in values:
+            if not isinstance(val, int):
+                return f"write value {val} is not an integer"
+            if not -2**63 <= val < 2**63:
+                # values are stored in 64-bit arrays
+                return f"write value {val} is out of range"
+        return None
+
+    def flush_commits(self):
+        """ Commit the transactions of the commit group in group commit mode. """
+        if not self.transMgr.pendingCommits:
+            return
+        if self.metrics is not None:
+            start = time.perf_counter()
+        self.current = None
+        self.transMgr.flush_commits()
+        if self.metrics is not None:
+            self.metrics.record_op("groupCommit", time.perf_counter() - start)
+
+    def execute(self, opName, args):
+        """
+        Flush the commit group unless the operation joins it, settle the wait list, then execute one operation.
+        Operations with invalid arguments are logged as errors and skipped.
+
+        Parameters
+        -----------
+        opName: str
+            Operation name
+        args: list
+            Operation arguments, the tick is appended to it
+
+        Returns: ResultType Enum
+        -----------
+        Result of the operation; None for unknown, rejected operations and operations without result.
+        """
+        error = self.check_operation(opName, args)
+        if error is not None:
+            name = opName.value if isinstance(opName, OperationType) else opName
+            logger.error("%s: Rejected %s%s: %s", self.tick, name, tuple(args), error)
+            return None
+        if not (opName == "end" and self.transMgr.can_join_commit_group(args[0], self.tick)):
+            self.flush_commits()
+        self.settle()
+        op = self.operations[opName]
+        self.current = args[0] if opName not in ("fail", "recover", "dump") else None
         # NOTE: now every operation function should have tick as the last parameter
-        logger.debug(f"{tick}: Executing {opName}({args})...")
+        logger.debug("%s: Executing %s(%s)...", self.tick, opName, args)
+        if self.metrics is not None:
+            start = time.perf_counter()
+        result = None
         if opName == 'dump' and args[0] == '':
             op()
         elif opName != 'dump':
-            args.append(tick)
-            lastResult = op(*args)
+            args.append(self.tick)
+            result = self.lastResult = op(*args)
         else:
             op(*args)
-        tick+=1 
+        if self.metrics is not None:
+            self.metrics.record_op(opName, time.perf_counter() - start)
+        self.tick+=1 
+        return result
+
+def run(executions, dataMgr, transMgr, detectionTrigger=None):
+    executor = Executor(dataMgr, transMgr, detectionTrigger)
+    for opName, args in executions:
+        executor.execute(opName, args)
+    executor.flush_commits()
+
+def build_parser(description='Replicated Concurrency Control and Recovery.'):
+    """ Build the parser of the engine options, shared by a run and the server. """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--logLevel', '--log-level', type=str.upper, default="DEBUG", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help='Lowest level of logged messages; debug messages are not formatted below DEBUG.')
+    parser.add_argument('--metrics', type=str, default=None, help='Collect metrics and write them to this JSON file.')
+    parser.add_argument('--durableDir', type=str, default=None, help='Directory of the write-ahead logs and checkpoints; sites restore their state from it.')
+    parser.add_argument('--checkpointInterval', type=int, default=1000, help='Number of WAL records of a site between checkpoints.')
+    parser.add_argument('--processPerSite', action='store_true', help='Run each site in its own process.')
+    parser.add_argument('--groupCommit', action='store_true', help='Commit transactions that end back-to-back together.')
+    parser.add_argument('--concurrencyControl', type=str, default="locking", choices=[cc.value for cc in ConcurrencyControl],
+                        help='Strict two phase locking, or optimistic validation of the reads of read write transactions at end '
+                             '(concurrent blind writes do not conflict, the last one to commit wins).')
+    parser.add_argument('--deadlockPolicy', type=str, default="detection", choices=[policy.value for policy in DeadlockPolicy],
+                        help='Detect deadlock cycles, or prevent them with wait-die or wound-wait.')
+    parser.add_argument('--detectionTrigger', type=str, default="onBlock", choices=list(DETECTION_TRIGGERS),
+                        help='When deadlock detection runs: after each blocked operation, periodically, '
+                             'above a wait list size or after a waiter timeout.')
+    parser.add_argument('--detectionTriggerValue', type=int, default=None,
+                        help='Interval in ticks (periodic), wait list size (threshold) or timeout in ticks (timeout).')
+    parser.add_argument('--loadImage', type=str, default=None, help='Start from a database image instead of the initial values.')
+    parser.add_argument('--saveImage', type=str, default=None, help='Save a database image at the end of the run.')
+    # with --loadImage, the layout is the one of the image and these options are only checked against it
+    parser.add_argument('--numOfSites', type=int, default=None, help=f'Number of sites (default: {NUM_OF_SITES}).')
+    parser.add_argument('--numOfVariables', type=int, default=None, help=f'Number of variables (default: {NUM_OF_VARIABLES}).')
+    parser.add_argument('--placement', type=str, default=None, choices=list(PLACEMENTS), help='Variable placement policy (default: default).')
+    parser.add_argument('--replicationFactor', type=int, default=None, 
+                        help='Number of copies of each variable for hash and range placement (default: 1).')
+    parser.add_argument('--replicaSelection', type=str, default="first", choices=list(REPLICA_SELECTIONS),
+                        help='Policy choosing the site to read a replicated variable from.')
+    return parser
+
+def parse_args(argv=None, parser=None):
+    """
+    Parse and check the command line options of a run.
+
+    Parameters
+    -----------
+    argv: list
+        Command line options, sys.argv[1:] if None
+    parser: argparse.ArgumentParser
+        Parser returned by `build_parser`, with options added by the caller; a new one if None
+
+    Returns: tuple
+    -----------
+    (argparse.Namespace, DetectionTrigger)
+    """
+    if parser is None:
+        parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.loadImage and args.durableDir:
+        parser.error("--loadImage cannot be used with --durableDir")
+    if args.saveImage and args.processPerSite:
+        parser.error("--saveImage cannot be used with --processPerSite")
+    try:
+        detectionTrigger = get_detection_trigger(args.detectionTrigger, args.detectionTriggerValue)
+    except ValueError as e:
+        parser.error(str(e))
+    return args, detectionTrigger
+
+def create_managers(args):
+    """
+    Create the data manager and the transaction manager of a run.
+
+    Parameters
+    -----------
+    args: argparse.Namespace
+        Options returned by `parse_args`
+
+    Returns: tuple
+    -----------
+    (DataMgr, TransactionMgr)
+
+    Raises: ValueError
+    -----------
+    If the size or placement options given with --loadImage do not match the image.
+    """
+    placement = None
+    if args.placement is not None or args.replicationFactor is not None or not args.loadImage:
+        placement = get_placement(args.placement or "default", args.replicationFactor or 1)
+    if args.loadImage:
+        DM = DataMgr.load_image(args.loadImage, placement, get_replica_selection(args.replicaSelection),
+                                args.numOfSites, args.numOfVariables)
+        if args.processPerSite:
+            DM.start_site_processes()
+    else:
+        numOfSites = args.numOfSites if args.numOfSites is not None else NUM_OF_SITES
+        numOfVariables = args.numOfVariables if args.numOfVariables is not None else NUM_OF_VARIABLES
+        DM = DataMgr(numOfSites, numOfVariables, placement, args.durableDir, args.checkpointInterval, 
+                     args.processPerSite, get_replica_selection(args.replicaSelection))
+    TM = TransactionMgr(DM, args.groupCommit, args.deadlockPolicy, args.concurrencyControl)
+    if args.metrics:
+        TM.attach_metrics(Metrics())
+    return DM, TM
+
+def save_results(args, dataMgr, transMgr):
+    """ Save the database image and export the metrics of a finished run, if the options ask for them. """
+    if args.saveImage:
+        dataMgr.save_image(args.saveImage)
+    if args.metrics:
+        transMgr.metrics.record_read_counts(dataMgr.get_read_counts())
+        transMgr.metrics.record_lock_table_sizes(dataMgr.get_lock_table_sizes(peak=True))
+        transMgr.metrics.record_version_counts(dataMgr.get_retained_version_counts(), 
+                                               dataMgr.get_retained_version_counts(peak=True))
+        transMgr.metrics.export_json(args.metrics)
 
 def main():
-    parser = argparse.ArgumentParser(description='Replicated Concurrency Control and Recovery.')
-    parser.add_argument('--testFile', type=str, default="tests/test1.txt", help='Path to test file.')
+    parser = build_parser()
+    parser.add_argument('--testFile', type=str, default="tests/test1.txt", help="Path to test file, or '-' to read from stdin.")
     parser.add_argument('--stdout', nargs='?', type=utils.str_to_bool, const=True, default=False)
-
-    args = parser.parse_args()
+    args, detectionTrigger = parse_args(parser=parser)
     
     utils.mkdir("./logs")
     utils.mkdir("./output")
     # curDatetime = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
-    testName = Path(args.testFile).stem
+    testName = "stdin" if args.testFile == '-' else Path(args.testFile).stem
 
     # logger setting
     filehdlr1 = logging.FileHandler(f"logs/{testName}.log", mode='w')
@@ -172,17 +475,32 @@ def main():
     else:
         handler = [filehdlr1, filehdlr2]
 
+    # records are formatted by the caller and written to files by a background thread
+    logQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(logQueue, *handler, respect_handler_level=True)
+    queueHdlr = logging.handlers.QueueHandler(logQueue)
+    # only merge the message with its args here, the file handlers apply SpecialFormatter
+    queueHdlr.setFormatter(logging.Formatter("%(message)s"))
     logging.basicConfig(
-        # level= logging.INFO,
-        level= logging.DEBUG,
-        handlers=handler
+        level= args.logLevel,
+        handlers=[queueHdlr]
     )
+    listener.start()
 
-    DM = DataMgr(NUM_OF_SITES, NUM_OF_VARIABLES)
-    TM = TransactionMgr(DM)
+    try:
+        DM, TM = create_managers(args)
+    except ValueError as e:
+        listener.stop()
+        parser.error(str(e))
 
-    execs = process_input(args.testFile)
-    run(execs, DM, TM)
+    try:
+        execs = process_input(args.testFile)
+        run(execs, DM, TM, detectionTrigger)
+        save_results(args, DM, TM)
+    finally:
+        DM.close()
+        # flush the remaining records
+        listener.stop()
     
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+Script that contains the opt-in metrics collected while running the engine.
+Components hold `metrics = None` unless metrics are enabled, so nothing is recorded by default.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+import json
+
+class Histogram(object):
+    def __init__(self) -> None:
+        """
+        Initialize Histogram of durations in seconds, bucketed by powers of two microseconds.
+        """
+        # upper bound in microseconds -> count
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = int(seconds * 1e6)
+        bound = 1 << micros.bit_length()
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "totalSeconds": self.total,
+            "meanSeconds": self.total / self.count if self.count else 0.0,
+            "maxSeconds": self.max,
+            "bucketsMicros": {f"<{bound}": self.buckets[bound] for bound in sorted(self.buckets)},
+        }
+
+class Metrics(object):
+    def __init__(self) -> None:
+        """
+        Initialize Metrics.
+        """
+        # operation name -> Histogram of latencies
+        self.opLatency = {}
+        # time wait objects spend in the wait list until executed or dropped
+        self.waitTime = Histogram()
+        # number of passes over woken wait objects, and of wait object retries
+        self.waitListRescans = 0
+        self.waitListRetries = 0
+        self.detectionTime = Histogram()
+        # transactions aborted by deadlock detection; breaking the cycles of a component may take several
+        self.numOfDeadlockVictims = 0
+        # ticks from the oldest wait object added since the previous detection to the detection
+        self.detectionDelayTicks = 0
+        self.maxDetectionDelay = 0
+        # site name -> largest number of lock table entries seen
+        self.peakLockTableSize = {}
+        # AbortReason -> number of aborts
+        self.abortReasons = {}
+        # site name -> number of reads served
+        self.readsPerSite = {}
+        # site name -> number of committed versions kept at the end, and the largest number kept at once
+        self.retainedVersions = {}
+        self.peakRetainedVersions = {}
+
+    def record_op(self, opName, seconds):
+        if opName not in self.opLatency:
+            self.opLatency[opName] = Histogram()
+        self.opLatency[opName].record(seconds)
+
+    def record_detection(self, seconds, numOfVictims, delayTicks=None):
+        self.detectionTime.record(seconds)
+        self.numOfDeadlockVictims += numOfVictims
+        if delayTicks is not None:
+            self.detectionDelayTicks += delayTicks
+            self.maxDetectionDelay = max(self.maxDetectionDelay, delayTicks)
+
+    def record_lock_table_sizes(self, sizes):
+        """
+        Parameters
+        -----------
+        sizes: dict
+            Site name -> largest number of lock table entries, from `DataMgr.get_lock_table_sizes(peak=True)`
+        """
+        self.peakLockTableSize = dict(sizes)
+
+    def record_read_counts(self, counts):
+        """
+        Parameters
+        -----------
+        counts: dict
+            Site name -> number of reads served, from `DataMgr.get_read_counts`
+        """
+        self.readsPerSite = dict(counts)
+
+    def record_version_counts(self, counts, peakCounts):
+        """
+        Parameters
+        -----------
+        counts: dict
+            Site name -> number of committed versions kept, from `DataMgr.get_retained_version_counts`
+        peakCounts: dict
+            Site name -> largest number of committed versions kept at once
+        """
+        self.retainedVersions = dict(counts)
+        self.peakRetainedVersions = dict(peakCounts)
+
+    def record_abort(self, reason):
+        self.abortReasons[reason] = self.abortReasons.get(reason, 0) + 1
+
+    def to_dict(self):
+        return {
+            "opLatency": {getattr(opName, "value", opName): hist.to_dict() for opName, hist in self.opLatency.items()},
+            "waitTime": self.waitTime.to_dict(),
+            "waitListRescans": self.waitListRescans,
+            "waitListRetries": self.waitListRetries,
+            "deadlockDetection": {
+                **self.detectionTime.to_dict(),
+                "victims": self.numOfDeadlockVictims,
+                "meanDelayTicks": self.detectionDelayTicks / self.detectionTime.count if self.detectionTime.count else 0.0,
+                "maxDelayTicks": self.maxDetectionDelay,
+            },
+            "peakLockTableSize": self.peakLockTableSize,
+            "abortReasons": {getattr(reason, "value", reason): count for reason, count in self.abortReasons.items()},
+            "readsPerSite": self.readsPerSite,
+            "retainedVersions": self.retainedVersions,
+            "peakRetainedVersions": self.peakRetainedVersions,
+        }
+
+    def export_json(self, path):
+        """
+        Write the metrics to a JSON file.
+
+        Parameters
+        -----------
+        path: str
+            Output file path
+        """
+        with open(path, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2)
@@ -0,0 +1,89 @@
+"""
+Script that contains the variable placement policies used by the data manager.
+
+@Author: Tanran Zheng (tz408@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+class Placement(object):
+    def get_sites(self, i, numOfSites, numOfVariable):
+        """
+        Get the sites that store variable xi.
+
+        Parameters
+        -----------
+        i: int
+            Variable index
+        numOfSites: int 
+            Total number of sites.
+        numOfVariable: int 
+            Total number of variable.
+
+        Returns: list
+        -----------
+        List of site numbers in increasing order; more than one site means xi is replicated.
+        """
+        raise NotImplementedError
+
+class DefaultPlacement(Placement):
+    """
+    The odd indexed variables are at one site each (site 1 + i mod number of sites). 
+    Even indexed variables are at all sites. 
+    """
+    def get_sites(self, i, numOfSites, numOfVariable):
+        if i % 2:
+            return [i % numOfSites + 1]
+        return list(range(1, numOfSites+1))
+
+class HashPlacement(Placement):
+    """
+    Each variable is at replicationFactor consecutive sites, starting from a site chosen by hashing its index.
+    """
+    def __init__(self, replicationFactor=1) -> None:
+        self.replicationFactor = replicationFactor
+
+    def get_sites(self, i, numOfSites, numOfVariable):
+        # Knuth's multiplicative hash, so neighbouring variables spread over sites
+        start = (i * 2654435761) % (2**32) % numOfSites
+        numOfCopies = min(self.replicationFactor, numOfSites)
+        return sorted((start + k) % numOfSites + 1 for k in range(numOfCopies))
+
+class RangePlacement(Placement):
+    """
+    Variables are split into contiguous ranges, one per site; 
+    each variable is also copied to the following replicationFactor-1 sites.
+    """
+    def __init__(self, replicationFactor=1) -> None:
+        self.replicationFactor = replicationFactor
+
+    def get_sites(self, i, numOfSites, numOfVariable):
+        start = (i - 1) * numOfSites // numOfVariable
+        numOfCopies = min(self.replicationFactor, numOfSites)
+        return sorted((start + k) % numOfSites + 1 for k in range(numOfCopies))
+
+PLACEMENTS = {
+    "default": DefaultPlacement,
+    "hash": HashPlacement,
+    "range": RangePlacement,
+}
+
+def get_placement(name, replicationFactor=1):
+    """
+    Create a placement policy by name.
+
+    Parameters
+    -----------
+    name: str
+        One of the keys of PLACEMENTS
+    replicationFactor: int
+        Number of copies of each variable, not used by the default placement
+
+    Returns: Placement
+    """
+    if name not in PLACEMENTS:
+        raise ValueError(f"Unknown placement {name}, should be one of {list(PLACEMENTS)}")
+    if name == "default":
+        return DefaultPlacement()
+    return PLACEMENTS[name](replicationFactor)
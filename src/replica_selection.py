@@ -0,0 +1,112 @@
+"""
+Script that contains the replica selection policies used by the data manager for reads of replicated variables.
+
+A policy orders the up sites storing a variable; the data manager reads from the first one in that
+order where the read can be done, so every policy still falls back to the other copies.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+from site_process import call_sites
+
+class ReplicaSelection(object):
+    def order(self, sites, x):
+        """
+        Order the sites to try for a read of replicated variable x.
+
+        Parameters
+        -----------
+        sites: list
+            List of up Site objects storing x, in site order
+        x: str
+            Variable name
+
+        Returns: list
+        -----------
+        List of the same Site objects, the preferred one first.
+        """
+        raise NotImplementedError
+
+class FirstSelection(ReplicaSelection):
+    """
+    Sites are tried in site order, so the lowest numbered up site serves most reads.
+    """
+    def order(self, sites, x):
+        return sites
+
+class RoundRobinSelection(ReplicaSelection):
+    """
+    Each read of a variable starts from the site after the one the previous read of it started from.
+    """
+    def __init__(self) -> None:
+        # variable name -> number of reads ordered so far
+        self.numOfReads = {}
+
+    def order(self, sites, x):
+        n = self.numOfReads.get(x, 0)
+        self.numOfReads[x] = n + 1
+        start = n % len(sites)
+        return sites[start:] + sites[:start]
+
+class _LoadSelection(ReplicaSelection):
+    """
+    Sites are tried from the least loaded one, ties in site order.
+    """
+    # Site method returning the load of the site
+    loadMethod = None
+
+    def order(self, sites, x):
+        loads = [results[0] for results in call_sites(sites, [(self.loadMethod, self._get_load_args(x))])]
+        # sorted is stable, so ties keep the site order
+        return [sites[i] for i in sorted(range(len(sites)), key=loads.__getitem__)]
+
+    def _get_load_args(self, x):
+        return []
+
+class LeastLocksSelection(_LoadSelection):
+    """
+    Sites holding the fewest read and write locks are tried first.
+    """
+    loadMethod = "get_num_of_locks_held"
+
+class FewestWaitersSelection(_LoadSelection):
+    """
+    Sites with the fewest transactions lined up for write locks are tried first.
+    """
+    loadMethod = "get_num_of_lined_up"
+
+class NoLinedUpWriterSelection(_LoadSelection):
+    """
+    Sites where no transaction is lined up for the write lock of the variable are tried first,
+    since a lined up writer blocks new readers there.
+    """
+    loadMethod = "has_lined_up_writer"
+
+    def _get_load_args(self, x):
+        return [x]
+
+REPLICA_SELECTIONS = {
+    "first": FirstSelection,
+    "roundRobin": RoundRobinSelection,
+    "leastLocks": LeastLocksSelection,
+    "fewestWaiters": FewestWaitersSelection,
+    "noLinedUpWriter": NoLinedUpWriterSelection,
+}
+
+def get_replica_selection(name):
+    """
+    Create a replica selection policy by name.
+
+    Parameters
+    -----------
+    name: str
+        One of the keys of REPLICA_SELECTIONS
+
+    Returns: ReplicaSelection
+    """
+    if name not in REPLICA_SELECTIONS:
+        raise ValueError(f"Unknown replica selection {name}, should be one of {list(REPLICA_SELECTIONS)}")
+    return REPLICA_SELECTIONS[name]()
@@ -0,0 +1,254 @@
+"""
+Long-running server mode: one DataMgr/TransactionMgr serves many client connections.
+
+Clients send operations in the input format, one per line (e.g. `begin(T1)`, `R(T1,x2)`).
+Operations are executed in arrival order, each taking the next tick. The server replies to
+each operation with the output lines of its transactions, followed by a status line
+`# <status>` (`success`, `abort`, `stop`, `error: ...`, or `done` for operations without result).
+Operations with invalid arguments, or beginning a transaction whose name is already active, are
+rejected with an `error: ...` status before they are executed.
+A blocked operation gets no reply until it is executed from the wait list, or its transaction aborts.
+With group commit, the commit group is committed after each operation, before the reply.
+When a client disconnects, the active transactions it began are aborted.
+
+The server takes the options of main.py, except --testFile and --stdout.
+
+Typical usage example:
+
+    python3 src/server.py --port 8765
+    python3 src/server.py --unixSocket /tmp/repcrec.sock
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+from main import Executor, SpecialFormatter, build_parser, create_managers, parse_args, parse_lines, save_results
+from const import AbortReason, ResultType
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Session(object):
+    def __init__(self, writer) -> None:
+        """
+        Initialize Session of a client connection.
+
+        Parameters
+        -----------
+        writer: asyncio.StreamWriter
+        """
+        self.writer = writer
+        # output lines not sent yet
+        self.output = []
+        # names of the active transactions this client began
+        self.transactions = set()
+
+    def reply(self, status):
+        lines = self.output + [f"# {status}"]
+        self.output = []
+        self.writer.write(("\n".join(lines) + "\n").encode())
+
+class _SessionOutput(logging.Handler):
+    """ Route the output of the engine to the session owning the current transaction. """
+    def __init__(self, server) -> None:
+        super().__init__(logging.INFO)
+        self.server = server
+        self.setFormatter(SpecialFormatter())
+
+    def emit(self, record):
+        if record.levelno != logging.INFO:
+            return
+        session = self.server.owners.get(self.server.executor.current, self.server.commandSession)
+        if session is not None:
+            session.output.append(self.format(record))
+
+class RepCRecServer(object):
+    def __init__(self, dataMgr, transMgr, detectionTrigger=None) -> None:
+        """
+        Initialize RepCRecServer.
+
+        Parameters
+        -----------
+        dataMgr: DataMgr object
+        transMgr: TransactionMgr object
+        detectionTrigger: DetectionTrigger
+            Policy deciding when deadlock detection runs, OnBlockTrigger if None.
+        """
+        self.transMgr = transMgr
+        self.executor = Executor(dataMgr, transMgr, detectionTrigger)
+        # name of an active transaction -> Session that began it
+        self.owners = {}
+        # connected sessions
+        self.sessions = set()
+        # transaction name -> future of the blocked operation of its session
+        self.parked = {}
+        # session whose operation is being executed
+        self.commandSession = None
+        self.outputHandler = _SessionOutput(self)
+
+    def _is_waiting(self, t):
+        transaction = self.transMgr.transactions.get(t)
+        return transaction is not None and self.transMgr.waitLists.get_waitObj_of_t(transaction) is not None
+
+    def _get_unblocked_status(self, t):
+        """ Status of a blocked operation of t that left the wait list. """
+        transaction = self.transMgr.transactions.get(t)
+        if transaction is None or transaction.abort:
+            return ResultType.ABORT.value
+        return ResultType.SUCCESS.value
+
+    def _forget_ended(self):
+        """ Drop the owners of the transactions that committed or aborted. """
+        for t, session in list(self.owners.items()):
+            if t not in self.transMgr.transactions:
+                del self.owners[t]
+                session.transactions.discard(t)
+
+    def _resolve_parked(self):
+        """ Reply to sessions whose blocked operation was executed or whose transaction aborted. """
+        for t, future in list(self.parked.items()):
+            if self._is_waiting(t):
+                continue
+            self.parked.pop(t)
+            if not future.done():
+                future.set_result(self._get_unblocked_status(t))
+
+    async def submit(self, session, opName, args):
+        """
+        Execute one operation of a session.
+
+        Returns: str
+        -----------
+        Status of the operation, after it is executed from the wait list if it was blocked.
+        """
+        self.commandSession = session
+        error = self.executor.check_operation(opName, args)
+        if error is not None:
+            return f"error: {error}"
+        if opName in ("begin", "beginRO"):
+            self.owners[args[0]] = session
+            session.transactions.add(args[0])
+
+        try:
+            result = self.executor.execute(opName, args)
+            # no operation may follow soon, so the commit group is not kept open
+            self.executor.flush_commits()
+            self.executor.settle()
+        except Exception as e:
+            logger.exception("%s: Failed to execute %s%s", self.executor.tick, opName, tuple(args))
+            self._resolve_parked()
+            self._forget_ended()
+            return f"error: {e!r}"
+
+        future = None
+        if result == ResultType.WL and self._is_waiting(args[0]):
+            future = asyncio.get_running_loop().create_future()
+            self.parked[args[0]] = future
+        self._resolve_parked()
+        self._forget_ended()
+        if future is not None:
+            return await future
+        if result == ResultType.WL:
+            # left the wait list right away
+            return self._get_unblocked_status(args[0])
+        return result.value if result is not None else "done"
+
+    def disconnect(self, session):
+        """ Abort the active transactions of a session that closed its connection. """
+        self.commandSession = None
+        self.sessions.discard(session)
+        for t in sorted(session.transactions):
+            if self.owners.get(t) is not session:
+                continue
+            self.parked.pop(t, None)
+            transaction = self.transMgr.transactions.get(t)
+            if transaction is not None:
+                self.executor.current = t
+                self.transMgr.abort(transaction, self.executor.tick, AbortReason.CLIENT_DISCONNECTED)
+                self.executor.tick += 1
+        self.executor.settle()
+        self._resolve_parked()
+        self._forget_ended()
+
+    async def handle_client(self, reader, writer):
+        session = Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode(errors="replace")
+                operations = list(parse_lines([text]))
+                if not operations:
+                    if text.strip() and not text.startswith("//"):
+                        session.reply(f"error: cannot parse {text.strip()}")
+                        await writer.drain()
+                    continue
+                opName, args = operations[0]
+                session.reply(await self.submit(session, opName, args))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect(session)
+            writer.close()
+
+    async def serve(self, host=None, port=None, unixSocket=None):
+        """
+        Serve clients until cancelled.
+
+        Parameters
+        -----------
+        host: str
+            TCP host
+        port: int
+            TCP port, used if unixSocket is None
+        unixSocket: str
+            Path of a Unix socket to listen on
+        """
+        logging.getLogger().addHandler(self.outputHandler)
+        try:
+            if unixSocket is not None:
+                server = await asyncio.start_unix_server(self.handle_client, path=unixSocket)
+            else:
+                server = await asyncio.start_server(self.handle_client, host=host, port=port)
+            logger.debug("Serving on %s", [sock.getsockname() for sock in server.sockets])
+            async with server:
+                await server.serve_forever()
+        finally:
+            logging.getLogger().removeHandler(self.outputHandler)
+
+def main():
+    parser = build_parser('Replicated Concurrency Control and Recovery server.')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='TCP host.')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port.')
+    parser.add_argument('--unixSocket', type=str, default=None, help='Listen on this Unix socket instead of TCP.')
+    parser.set_defaults(logLevel="INFO")
+    args, detectionTrigger = parse_args(parser=parser)
+
+    # the output goes to the sessions, errors and their tracebacks to stderr
+    errorHdlr = logging.StreamHandler()
+    errorHdlr.setLevel(logging.WARNING)
+    errorHdlr.setFormatter(SpecialFormatter())
+    logging.basicConfig(level=args.logLevel, handlers=[errorHdlr])
+    try:
+        DM, TM = create_managers(args)
+    except ValueError as e:
+        parser.error(str(e))
+    server = RepCRecServer(DM, TM, detectionTrigger)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unixSocket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            save_results(args, DM, TM)
+        finally:
+            DM.close()
+
+if __name__ == "__main__":
+    main()
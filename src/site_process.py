@@ -0,0 +1,271 @@
+"""
+Script that contains the process-per-site execution mode.
+
+Each site runs in its own worker process. The data manager talks to it through a
+RemoteSite proxy that has the same interface as Site. Calls are sent as batches of
+(method, args) messages; `submit` sends a batch without waiting so several sites can
+work in parallel, and `gather` collects the replies in the order the caller asks for them.
+Log records of a worker are sent back with its replies and emitted by the proxy,
+so the output stays in the same order as in the in-process mode.
+Transactions are sent as TransactionKey tuples: the worker keeps its own transaction objects,
+and sends back the state its site changed on them with each reply.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+import logging
+import multiprocessing
+
+from transaction_mgr import Transaction
+
+logger = logging.getLogger(__name__)
+
+# methods after which a site forgets the transaction; other ended transactions are forgotten with `RemoteSite.forget`
+ENDING_METHODS = ("commit", "abort")
+
+class TransactionKey(tuple):
+    """ (name, startTime, readOnly) of a transaction, sent between the proxy and the worker instead of the transaction. """
+    __slots__ = ()
+
+def _key(t):
+    return TransactionKey((t.name, t.startTime, t.readOnly))
+
+class _RecordCollector(logging.Handler):
+    """ Keep the log records of a worker to send them back with the reply. """
+    def __init__(self) -> None:
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # merge the message with its args, they may not be picklable
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+    def pop_records(self):
+        records = self.records
+        self.records = []
+        return records
+
+def _iter_transactions(value):
+    """ Yield the transactions in a call argument or result, looking into lists and tuples. """
+    if isinstance(value, Transaction):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _iter_transactions(item)
+
+def _replace_transactions(value, replace):
+    """ Replace the transactions or transaction keys in a call argument or result, looking into lists and tuples. """
+    if isinstance(value, (Transaction, TransactionKey)):
+        return replace(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_replace_transactions(item, replace) for item in value)
+    return value
+
+def _run_site(conn, site, logLevel):
+    """
+    Worker loop of a site process.
+
+    Parameters
+    -----------
+    conn: Connection
+        Pipe end to the proxy
+    site: Site object
+    logLevel: int
+        Level of the parent's root logger
+    """
+    collector = _RecordCollector()
+    root = logging.getLogger()
+    root.handlers = [collector]
+    root.setLevel(logLevel)
+
+    # TransactionKey -> transaction object of this process
+    transactions = {}
+    def canonical(key):
+        if key not in transactions:
+            transactions[key] = Transaction(*key)
+        return transactions[key]
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        forgotten, calls = message
+        for key in forgotten:
+            transactions.pop(key, None)
+
+        results = []
+        seen = {}
+        for method, args in calls:
+            args = [_replace_transactions(arg, canonical) for arg in args]
+            result = getattr(site, method)(*args)
+            results.append(_replace_transactions(result, _key))
+            for t in _iter_transactions(args + [result]):
+                seen[_key(t)] = t
+            if method in ENDING_METHODS:
+                transactions.pop(_key(args[0]), None)
+
+        # state this site may have changed on the transactions
+        states = {key: (t.abort, t.abortReason, t.touched.get(site.name)) for key, t in seen.items()}
+        conn.send((results, states, site.isActive, collector.pop_records()))
+    conn.close()
+
+class RemoteSite(object):
+    def __init__(self, site, context=None) -> None:
+        """
+        Start a worker process running the site and initialize the proxy.
+
+        Parameters
+        -----------
+        site: Site object
+            The site to move to the worker; it should not be used afterwards.
+        context: multiprocessing context
+            Context to start the worker with; the "spawn" context if None.
+        """
+        self.name = site.name
+        self.isActive = site.isActive
+        self.log = None
+        # the variables of a site never change, keep their names for iteration and membership tests
+        self.committedVariables = dict.fromkeys(site.committedVariables)
+        # TransactionKey -> transaction object of this process
+        self.transactions = {}
+        # keys of ended transactions the worker should drop, sent with the next batch
+        self.forgotten = []
+        self.pending = None
+
+        context = context if context is not None else multiprocessing.get_context("spawn")
+        self.conn, workerConn = context.Pipe()
+        self.process = context.Process(target=_run_site, args=(workerConn, site, logging.getLogger().getEffectiveLevel()),
+                                       name=f"site{site.name}", daemon=True)
+        self.process.start()
+        workerConn.close()
+
+    def __repr__(self) -> str:
+        return f"{self.name}"
+
+    def submit(self, calls):
+        """
+        Send a batch of calls without waiting for the reply.
+
+        Parameters
+        -----------
+        calls: list
+            List of (method name, args) tuples
+        """
+        self.pending = calls
+        calls = [(method, [_replace_transactions(arg, self._to_key) for arg in args]) for method, args in calls]
+        self.conn.send((self.forgotten, calls))
+        self.forgotten = []
+
+    def gather(self):
+        """
+        Wait for the reply of the submitted batch.
+
+        Returns: list
+        -----------
+        Results of the calls.
+        """
+        calls, self.pending = self.pending, None
+        results, states, self.isActive, records = self.conn.recv()
+
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+
+        for key, (abort, abortReason, touched) in states.items():
+            t = self.transactions.get(key)
+            if t is None:
+                continue
+            if abort and not t.abort:
+                t.abort = True
+                t.abortReason = abortReason
+            if touched:
+                t.touched[self.name] = set(touched)
+
+        results = [_replace_transactions(result, self._to_local) for result in results]
+        for method, args in calls:
+            if method in ENDING_METHODS:
+                self.transactions.pop(_key(args[0]), None)
+        return results
+
+    def forget(self, transaction):
+        """
+        Drop a transaction that ended; the worker drops its copy when it gets the next batch.
+
+        Parameters
+        -----------
+        transaction: transaction object
+        """
+        key = _key(transaction)
+        if self.transactions.pop(key, None) is not None:
+            self.forgotten.append(key)
+
+    def _to_key(self, transaction):
+        """ Register a transaction sent to the worker and return its key. """
+        key = _key(transaction)
+        self.transactions[key] = transaction
+        return key
+
+    def _to_local(self, key):
+        """ Get the transaction object of this process with a key sent back by the worker. """
+        if key not in self.transactions:
+            # not sent by this proxy, e.g. ended and forgotten since
+            return Transaction(*key)
+        return self.transactions[key]
+
+    def call(self, method, *args):
+        self.submit([(method, list(args))])
+        return self.gather()[0]
+
+    def __getattr__(self, method):
+        # any other Site method runs in the worker
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+    def close(self):
+        """ Stop the worker process. """
+        if self.process.is_alive():
+            self.conn.send(None)
+            self.process.join()
+        self.conn.close()
+
+def call_each_site(siteCalls):
+    """
+    Run a batch of calls on each of several sites; remote sites run their batches in parallel.
+
+    Parameters
+    -----------
+    siteCalls: list
+        List of (Site or RemoteSite object, list of (method name, args) tuples)
+
+    Returns: list
+    -----------
+    For each site, the list of results of its calls.
+    """
+    for site, calls in siteCalls:
+        if isinstance(site, RemoteSite):
+            site.submit(calls)
+    return [site.gather() if isinstance(site, RemoteSite) else [getattr(site, method)(*args) for method, args in calls]
+            for site, calls in siteCalls]
+
+def call_sites(sites, calls):
+    """
+    Run the same batch of calls on several sites; remote sites run it in parallel.
+
+    Parameters
+    -----------
+    sites: list
+        List of Site or RemoteSite objects
+    calls: list
+        List of (method name, args) tuples
+
+    Returns: list
+    -----------
+    For each site, the list of results of the calls.
+    """
+    return call_each_site([(site, calls) for site in sites])
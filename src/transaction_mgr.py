@@ -7,13 +7,16 @@ Script that contains the class that implements the transaction manager.
 
 """
 
-from const import OperationType, ResultType
+from const import AbortReason, ConcurrencyControl, DeadlockPolicy, OperationType, ResultType
 from waitlist_mgr import WaitList
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Transaction(object):
+    __slots__ = ('name', 'startTime', 'readOnly', 'isBlocked', 'abort', 'abortReason', 'touched', 'readVersions', 'writeSet',
+                 'validation')
+
     def __init__(self, name, startTime, readOnly) -> None:
         """
         Initialize Transaction.
@@ -33,6 +36,16 @@ class Transaction(object):
 
         self.isBlocked = False
         self.abort = False
+        # AbortReason of the pending abort, set together with `abort`
+        self.abortReason = None
+        # site name -> names of variables this transaction read, wrote, locked or lined up on there
+        self.touched = {}
+        # with optimistic concurrency control: variable name -> commit tick of the version first read,
+        # and names of the variables written; None otherwise
+        self.readVersions = None
+        self.writeSet = None
+        # (tick, result) of the last optimistic validation
+        self.validation = None
 
     def __eq__(self, other): 
         return isinstance(other, type(self)) \
@@ -50,13 +63,75 @@ class Transaction(object):
 
     def __lt__(self, other):
          return self.name < other.name
+
+    def touch(self, site, x):
+        """
+        Record that this transaction accessed variable x on a site.
+
+        Parameters
+        -----------
+        site: str
+            Site name
+        x: str
+            Variable name
+        """
+        if site not in self.touched:
+            self.touched[site] = set()
+        self.touched[site].add(x)
+
+    def get_touched_sites(self):
+        """ Return the names of the sites this transaction accessed. """
+        return list(self.touched)
+
+    def get_touched_variables(self, site):
+        """ Return the names of the variables this transaction accessed on a site. """
+        return self.touched.get(site, ())
     
 class TransactionMgr(object):
-    def __init__(self, dataMgr) -> None:
+    def __init__(self, dataMgr, groupCommit=False, deadlockPolicy=DeadlockPolicy.DETECTION,
+                 concurrencyControl=ConcurrencyControl.LOCKING) -> None:
+        """
+        Initialize TransactionMgr.
+
+        Parameters
+        -----------
+        dataMgr: DataMgr object
+        groupCommit: bool
+            If True, transactions ready to commit at `end` are committed together by `flush_commits`.
+        deadlockPolicy: DeadlockPolicy Enum
+            Detect deadlock cycles after blocking, or prevent them with wait-die or wound-wait.
+        concurrencyControl: ConcurrencyControl Enum
+            Strict two phase locking, or optimistic: read write transactions take no locks, 
+            and are validated at `end` against the versions committed since they read.
+        """
         self.dataMgr = dataMgr
         self.transactions = {}
+        # start time of active read only transactions, in the order they began
+        self.activeROs = {}
+        # number of committed and aborted transactions
+        self.numOfCommits = 0
+        self.numOfAborts = 0
+        # Metrics object if metrics are enabled
+        self.metrics = None
+        self.groupCommit = groupCommit
+        # transaction name -> (transaction object, end tick) of the commits waiting for the group
+        self.pendingCommits = {}
+        self.optimistic = ConcurrencyControl(concurrencyControl) == ConcurrencyControl.OPTIMISTIC
 
         self.waitLists = WaitList()
+        self.waitLists.deadlockPolicy = DeadlockPolicy(deadlockPolicy)
+        self.dataMgr.attach_waitList(self.waitLists)
+
+    def attach_metrics(self, metrics):
+        """
+        Enable metrics collection in the transaction manager and its wait list.
+
+        Parameters
+        -----------
+        metrics: Metrics object
+        """
+        self.metrics = metrics
+        self.waitLists.metrics = metrics
 
     def start_transaction(self, t, tick):
         """
@@ -68,7 +143,10 @@ class TransactionMgr(object):
             Transaction name
         """
         self.transactions[t] = Transaction(t, tick, readOnly=False)
-        logger.debug(f"{tick}: Start transaction {t}")
+        if self.optimistic:
+            self.transactions[t].readVersions = {}
+            self.transactions[t].writeSet = set()
+        logger.debug("%s: Start transaction %s", tick, t)
 
     def start_RO_transaction(self, t, tick):
         """
@@ -79,11 +157,32 @@ class TransactionMgr(object):
         t: str
             Transaction name
         """
+        # sites keep committed versions, so reads only need the start time
         self.transactions[t] = Transaction(t, tick, readOnly=True)
-        for site in self.dataMgr.get_available_sites():
-            site.request_copy_for_RO(self.transactions[t])
+        self.activeROs.pop(t, None)
+        self.activeROs[t] = tick
+        self._update_snapshot_watermark()
+
+        logger.debug("%s: Start RO transaction %s", tick, t)
+
+    def get_snapshot_watermark(self):
+        """
+        Get the start time of the oldest active read only transaction.
 
-        logger.debug(f"{tick}: Start RO transaction {t}")
+        Return: int
+        -----------
+        The start time; None if there is no active read only transaction.
+        """
+        return next(iter(self.activeROs.values()), None)
+
+    def _update_snapshot_watermark(self):
+        self.dataMgr.set_snapshot_watermark(self.get_snapshot_watermark())
+
+    def _end_RO_transaction(self, t):
+        """ Stop keeping versions for read only transaction t. """
+        if t.readOnly and self.activeROs.get(t.name) == t.startTime:
+            self.activeROs.pop(t.name)
+            self._update_snapshot_watermark()
 
     def read(self, t, x, tick):
         """
@@ -104,14 +203,14 @@ class TransactionMgr(object):
         """
         if t not in self.transactions:
             # abort because of deadlock
-            logger.debug(f"{t} skip end because aborted due to deadlock")
+            logger.debug("%s skip end because aborted due to deadlock", t)
             return ResultType.STOP
 
-        logger.debug(f"{tick}: {t} tries to read {x}...")
+        logger.debug("%s: %s tries to read %s...", tick, t, x)
 
         transaction = self.transactions[t]
         if transaction.abort:
-            logger.debug(f"{tick}: {t} aborted, will not process read")
+            logger.debug("%s: %s aborted, will not process read", tick, t)
             return ResultType.STOP
 
         # if transaction.isBlocked:
@@ -122,32 +221,183 @@ class TransactionMgr(object):
         if transaction.readOnly:
             var = self.dataMgr.request_read_only(transaction, x)
             if var == None:
-                if self.dataMgr.get_site_index(x) == None:
+                if self.dataMgr.is_replicated(x):
                     # replicated variable
                     # abort immediately 
                     # self.abort(transaction, tick)
                     # abort at "end"
-                    transaction.abort = True
-                    return ResultType.ABORT
+                    return self._mark_no_visible_version(transaction)
                 else:
-                    self.waitLists.add_to_waitList(transaction, OperationType.READ, [t,x], blockedBy=[])
+                    self.waitLists.add_to_waitList(transaction, OperationType.READ, [t,x], blockedBy=[], tick=tick)
                     return ResultType.WL
 
-            logger.debug(f"{tick}: {t} successfully read {var}")
+            logger.debug("%s: %s successfully read %s", tick, t, var)
             # logger.info(f"{t} reads - "+ str(var))
 
         else:
-            ifSuccess, var = self.dataMgr.request_read(transaction, x, tick)
+            ifSuccess, var = self.dataMgr.request_read(transaction, x, tick, takeLock=not self.optimistic)
             if not ifSuccess:
                 # add to wait list, var is the lock object blocking current transaction
-                self.waitLists.add_to_waitList(transaction, OperationType.READ, [t,x], blockedBy=var)
-                return ResultType.WL
+                return self._block(transaction, OperationType.READ, [t,x], var, tick)
 
-            logger.debug(f"{tick}: {t} successfully read {var}")
+            if self.optimistic:
+                self._record_read(transaction, x, var)
+            logger.debug("%s: %s successfully read %s", tick, t, var)
             # logger.info(f"{t} reads - "+ str(var))
 
         return ResultType.SUCCESS
 
+    def _record_read(self, transaction, x, var):
+        """ Record the version an optimistic transaction read, unless it read its own write. """
+        if x not in transaction.writeSet:
+            transaction.readVersions.setdefault(x, var.lastCommittedTime)
+
+    def _validate(self, transaction, tick):
+        """
+        Validate an optimistic transaction at `end`, once per tick: the result is kept for `end` after 
+        the group commit check, the commits in between could not make it pass.
+
+        Parameters
+        -----------
+        transaction: transaction object
+        tick: int
+            Current tick
+
+        Returns: bool
+        -----------
+        True if the transaction can commit.
+        """
+        if transaction.validation is None or transaction.validation[0] != tick:
+            transaction.validation = (tick, self._reads_are_current(transaction))
+        return transaction.validation[1]
+
+    def _reads_are_current(self, transaction):
+        """
+        Check that no version of a variable the transaction read was committed after the one it read, 
+        on any site that is up, or is about to be committed by the commit group.
+        Only reads are checked: blind writes of concurrent transactions do not conflict, the last one to commit wins.
+        """
+        reads = transaction.readVersions
+        if not reads:
+            return True
+        # writes of the commit group are installed after this validation
+        for pending, _ in self.pendingCommits.values():
+            if pending.writeSet and not pending.writeSet.isdisjoint(reads):
+                return False
+        latest = self.dataMgr.get_latest_commit_times(reads)
+        return all(latest.get(x, seen) <= seen for x, seen in reads.items())
+
+    def _mark_no_visible_version(self, transaction):
+        """ Mark read only transaction to abort at `end`, no site can serve the version it should read. """
+        transaction.abort = True
+        transaction.abortReason = AbortReason.NO_VISIBLE_VERSION
+        # pending operations of this transaction can now be stopped
+        self.waitLists.wake_transaction(transaction)
+        return ResultType.ABORT
+
+    def read_batch(self, t, variables, tick):
+        """
+        Process batch read request: read several variables at once. 
+        The read locks are taken in one pass, and the batch blocks as a unit.
+
+        Parameters
+        -----------
+        t: str
+            Transaction name
+        variables: list
+            Names of the variables to read
+        tick: int
+            Current tick
+
+        Return: ResultType Enum
+        -----------
+        Type of return
+        """
+        if t not in self.transactions:
+            # abort because of deadlock
+            logger.debug("%s skip batch read because aborted due to deadlock", t)
+            return ResultType.STOP
+
+        logger.debug("%s: %s tries to read %s...", tick, t, variables)
+
+        transaction = self.transactions[t]
+        if transaction.abort:
+            logger.debug("%s: %s aborted, will not process batch read", tick, t)
+            return ResultType.STOP
+
+        if transaction.readOnly:
+            # read only transactions take no locks, only wait until every non replicated variable has a site up
+            for x in variables:
+                if not self.dataMgr.is_replicated(x) and not self.dataMgr.get_available_sites_for_variable(x):
+                    return self._block(transaction, OperationType.BATCH_READ, [t,variables], [], tick)
+            for x in variables:
+                if self.dataMgr.request_read_only(transaction, x) is None:
+                    return self._mark_no_visible_version(transaction)
+        elif self.optimistic:
+            # no locks to take, only wait until every variable has a site up
+            if not all(self.dataMgr.get_available_sites_for_variable(x) for x in variables):
+                return self._block(transaction, OperationType.BATCH_READ, [t,variables], [], tick)
+            for x in variables:
+                ifSuccess, var = self.dataMgr.request_read(transaction, x, tick, takeLock=False)
+                if not ifSuccess:
+                    return self._block(transaction, OperationType.BATCH_READ, [t,variables], var, tick)
+                self._record_read(transaction, x, var)
+        else:
+            ifSuccess, var = self.dataMgr.request_read_batch(transaction, variables, tick)
+            if not ifSuccess:
+                # add to wait list, var is the lock object blocking current transaction
+                return self._block(transaction, OperationType.BATCH_READ, [t,variables], var, tick)
+
+        logger.debug("%s: %s successfully read %s", tick, t, variables)
+        return ResultType.SUCCESS
+
+    def write_batch(self, t, writes, tick):
+        """
+        Process batch write request: write several variables at once. 
+        The write locks are taken in one pass, and the batch blocks as a unit.
+
+        Parameters
+        -----------
+        t: str
+            Transaction name
+        writes: dict
+            Variable name -> value to write
+        tick: int
+            Current tick
+
+        Return: ResultType Enum
+        -----------
+        Type of return
+        """
+        if t not in self.transactions:
+            # abort because of deadlock
+            logger.debug("%s skip batch write because aborted due to deadlock", t)
+            return ResultType.STOP
+
+        logger.debug("%s: %s tries to write %s...", tick, t, writes)
+
+        transaction = self.transactions[t]
+        if transaction.abort:
+            logger.debug("%s: %s aborted, will not process batch write", tick, t)
+            return ResultType.STOP
+
+        if self.optimistic:
+            # no locks to take, only wait until every variable has a site up
+            if not all(self.dataMgr.get_available_sites_for_variable(x) for x in writes):
+                return self._block(transaction, OperationType.BATCH_WRITE, [t,writes], [], tick)
+            for x, val in writes.items():
+                self.dataMgr.request_write(transaction, x, val, tick, takeLock=False)
+                transaction.writeSet.add(x)
+        else:
+            ifSuccess, var = self.dataMgr.request_write_batch(transaction, writes, tick)
+            if not ifSuccess:
+                return self._block(transaction, OperationType.BATCH_WRITE, [t,writes], var, tick)
+            if transaction.writeSet is not None:
+                transaction.writeSet.update(writes)
+
+        logger.debug("%s: %s successfully write %s", tick, t, writes)
+        return ResultType.SUCCESS
+
     def write(self, t, x, val ,tick):
         """
         Process write request.
@@ -158,7 +408,7 @@ class TransactionMgr(object):
             Transaction name
         x: str
             Name of the variable to write on
-        val: str
+        val: int
             The value to write
         tick: int
             Current tick
@@ -169,14 +419,14 @@ class TransactionMgr(object):
         """
         if t not in self.transactions:
             # abort because of deadlock
-            logger.debug(f"{t} skip `end` because aborted due to deadlock")
+            logger.debug("%s skip `end` because aborted due to deadlock", t)
             return ResultType.STOP
             
-        logger.debug(f"{tick}: {t} tries to write {x}: {val}...")
+        logger.debug("%s: %s tries to write %s: %s...", tick, t, x, val)
 
         transaction = self.transactions[t]
         if transaction.abort:
-            logger.debug(f"{tick}: {t} aborted, will not process write")
+            logger.debug("%s: %s aborted, will not process write", tick, t)
             return ResultType.STOP
 
         # if transaction.isBlocked:
@@ -184,15 +434,51 @@ class TransactionMgr(object):
         #     self.waitLists.add_to_waitList(transaction, OperationType.READ, [t,x], blockedBy=[])
         #     return ResultType.WL
 
-        ifSuccess, var = self.dataMgr.request_write(transaction, x, val, tick)
+        ifSuccess, var = self.dataMgr.request_write(transaction, x, val, tick, takeLock=not self.optimistic)
         if not ifSuccess:       
-            self.waitLists.add_to_waitList(transaction, OperationType.WRITE, [t,x,val], blockedBy=var)
-            return ResultType.WL
+            return self._block(transaction, OperationType.WRITE, [t,x,val], var, tick)
+
+        if transaction.writeSet is not None:
+            transaction.writeSet.add(x)
 
-        logger.debug(f"{tick}: {t} successfully write {x}: {val}")
+        logger.debug("%s: %s successfully write %s: %s", tick, t, x, val)
         return ResultType.SUCCESS
             
-    def abort(self, t, tick):
+    def _block(self, transaction, op, args, blockedBy, tick):
+        """
+        Add a blocked operation to the wait list, then apply the deadlock prevention policy.
+
+        Parameters
+        -----------
+        transaction: transaction object
+        op: OperationType Enum
+        args: list
+            List of operation arguments
+        blockedBy: list
+            list of transaction object
+        tick: int
+            Current tick
+
+        Return: ResultType Enum
+        -----------
+        ABORT if the transaction dies, WL otherwise.
+        """
+        self.waitLists.add_to_waitList(transaction, op, args, blockedBy=blockedBy, tick=tick)
+        victims = self.waitLists.get_prevention_victims(transaction, blockedBy)
+        if transaction in victims:
+            logger.debug("%s: %s is younger than a transaction blocking it, dies.", tick, transaction)
+            self.abort(transaction, tick, AbortReason.WAIT_DIE)
+            return ResultType.ABORT
+
+        for victim in victims:
+            # a transaction in the commit group is already committing
+            if victim.name in self.pendingCommits:
+                continue
+            logger.debug("%s: %s wounds younger transaction %s.", tick, transaction, victim)
+            self.abort(victim, tick, AbortReason.WOUND_WAIT)
+        return ResultType.WL
+
+    def abort(self, t, tick, reason=None):
         """
         Process abort request.
         
@@ -202,12 +488,19 @@ class TransactionMgr(object):
             Transaction object
         tick: int
             Current tick
+        reason: AbortReason Enum
+            Why the transaction aborts, for metrics
         """
-        logger.debug(f"{tick}: Receive request to abort {t}.")
+        logger.debug("%s: Receive request to abort %s.", tick, t)
         self.dataMgr.abort_on_all_sites(t)
         self.transactions.pop(t.name)
+        self.dataMgr.forget_transaction(t)
         self.waitLists.remove_waitObj_of_t(t)
-        logger.info(f"Abort: {t.name}")
+        self._end_RO_transaction(t)
+        self.numOfAborts += 1
+        if self.metrics is not None:
+            self.metrics.record_abort(reason)
+        logger.info("Abort: %s", t.name)
 
     def commit(self, t, tick):
         """
@@ -220,17 +513,84 @@ class TransactionMgr(object):
         tick: int
             Current tick
         """
-        logger.debug(f"{tick}: Receive request to commit {t}.")
+        logger.debug("%s: Receive request to commit %s.", tick, t)
         if self.waitLists.get_waitObj_of_t(t):
-            logger.debug(f"{tick}: {t} There are pending executions, will abort!")
-            self.abort(t, tick)
+            logger.debug("%s: %s There are pending executions, will abort!", tick, t)
+            self.abort(t, tick, AbortReason.PENDING_OPERATIONS)
             return
             # logger.error(f"{tick}: {t} There are pending executions, please check!")
 
+        if self.optimistic and not t.readOnly and not self._validate(t, tick):
+            logger.debug("%s: %s read a version overwritten since, fails validation.", tick, t)
+            self.abort(t, tick, AbortReason.VALIDATION_FAILED)
+            return
+
+        if self.groupCommit:
+            logger.debug("%s: %s joins the commit group.", tick, t)
+            self.pendingCommits[t.name] = (t, tick)
+            return
+
         self.dataMgr.commit_on_all_sites(t, tick)
         self.transactions.pop(t.name)
+        self.dataMgr.forget_transaction(t)
+        self._end_RO_transaction(t)
+        self.numOfCommits += 1
 
-        logger.info(f"Commit: {t.name}")
+        logger.info("Commit: %s", t.name)
+
+    def can_join_commit_group(self, t, tick):
+        """
+        Check if `end` of transaction t would only add it to the commit group.
+
+        Parameters
+        -----------
+        t: str
+            Transaction name
+        tick: int
+            Current tick
+
+        Returns: bool
+        -----------
+        True in group commit mode if t is active, not marked to abort, has no pending operations, 
+        committing the group so far would not wake up waiters (they have to run before t ends, as without 
+        group commit) and, with optimistic concurrency control, read write transaction t passes validation.
+        """
+        transaction = self.transactions.get(t)
+        return self.groupCommit and transaction is not None and t not in self.pendingCommits \
+            and not transaction.abort and self.waitLists.get_waitObj_of_t(transaction) is None \
+            and not any(self._wakes_waiters(pending) for pending, _ in self.pendingCommits.values()) \
+            and (not self.optimistic or transaction.readOnly or self._validate(transaction, tick))
+
+    def _wakes_waiters(self, transaction):
+        """ Check if committing transaction would wake up wait objects. """
+        variables = (x for touched in transaction.touched.values() for x in touched)
+        return self.waitLists.has_waiters_on(transaction, variables)
+
+    def flush_commits(self):
+        """
+        Commit the transactions of the commit group, in the order they ended.
+
+        Returns: int
+        -----------
+        Number of transactions committed.
+        """
+        if not self.pendingCommits:
+            return 0
+        commits = list(self.pendingCommits.values())
+        self.pendingCommits = {}
+        self.dataMgr.group_commit_on_all_sites(commits)
+        for t, _ in commits:
+            self.transactions.pop(t.name)
+            self.dataMgr.forget_transaction(t)
+            self.numOfCommits += 1
+            logger.info("Commit: %s", t.name)
+        # the watermark only moves once for the group
+        endedROs = [t for t, _ in commits if t.readOnly and self.activeROs.get(t.name) == t.startTime]
+        for t in endedROs:
+            self.activeROs.pop(t.name)
+        if endedROs:
+            self._update_snapshot_watermark()
+        return len(commits)
 
     def end(self, t, tick):
         """
@@ -245,12 +605,12 @@ class TransactionMgr(object):
         """
         if t not in self.transactions:
             # abort because of deadlock
-            logger.debug(f"{t} skips `end` because aborted due to deadlock")
+            logger.debug("%s skips `end` because aborted due to deadlock", t)
             return 
         else:
             transaction = self.transactions[t]
         if transaction.abort:
-            self.abort(transaction, tick)
+            self.abort(transaction, tick, transaction.abortReason)
         else:
             self.commit(transaction, tick)
         
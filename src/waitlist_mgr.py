@@ -7,11 +7,16 @@ Script that contains the class that implements the waitlist manager.
 
 """
 
+from const import DeadlockPolicy
+from collections import deque
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 class WaitObj(object):
+    __slots__ = ('operation', 't', 'variables', 'seq', 'addedAt', 'addedTick', 'blockedBy')
+
     def __init__(self, t, op, args, blockedBy) -> None:
         """
         Initialize Wait Object.
@@ -20,7 +25,7 @@ class WaitObj(object):
         -----------
         t: transaction object 
         op: OperationType Enum  
-            Operation read or write
+            Operation read or write, or batch read or write
         args: list
             List of operation arguments
         blockedBy: list
@@ -28,6 +33,14 @@ class WaitObj(object):
         """
         self.operation = (op, args)
         self.t = t
+        # the variables this operation is waiting on, a batch waits on all of them
+        self.variables = [args[1]] if isinstance(args[1], str) else list(args[1])
+        # position in the wait list, used to keep FIFO order when woken up
+        self.seq = -1
+        # perf_counter time when added to the wait list, only set if metrics are enabled
+        self.addedAt = None
+        # tick when added to the wait list
+        self.addedTick = None
         self.blockedBy = []
         for t in blockedBy:
             if t not in self.blockedBy:
@@ -47,13 +60,49 @@ class WaitObj(object):
     
 class WaitList(object):
     def __init__(self) -> None:
-        self.waitList = []
+        # seq -> wait object, in the order they were added
+        self.waitList = {}
+        self.nextSeq = 0
 
-        self.visitedWaitObj = []
-        self.path = []
+        # indexes from variable, lock holder and waiting transaction to wait objects, each keyed by seq
+        self.waitersOnVariable = {}
+        self.waitersOnBlocker = {}
+        self.waitersOfTransaction = {}
+        # wait objects that might be executable now, keyed by seq
+        self.woken = {}
+        # waits-for graph: waiting transaction -> {blocking transaction: number of wait objects}
+        self.waitsFor = {}
+        # Metrics object if metrics are enabled
+        self.metrics = None
+        self.deadlockPolicy = DeadlockPolicy.DETECTION
 
     def get_waitList(self):
-        return self.waitList
+        return list(self.waitList.values())
+
+    def get_size(self):
+        """ Return the number of wait objects in the wait list. """
+        return len(self.waitList)
+
+    def get_oldest_since(self, seq):
+        """
+        Get the oldest wait object added at or after a position of the wait list.
+        Only the wait objects added since are visited, newest first.
+
+        Parameters
+        -----------
+        seq: int
+            Position in the wait list
+
+        Return: Wait Obj
+        -----------
+        The wait object; None if there is none.
+        """
+        oldest = None
+        for waitObj in reversed(self.waitList.values()):
+            if waitObj.seq < seq:
+                break
+            oldest = waitObj
+        return oldest
 
     def get_waitObj_of_t(self, t):
         """
@@ -65,25 +114,59 @@ class WaitList(object):
 
         Return: Wait Obj
         """
-        for waitObj in self.waitList:
-            if t == waitObj.t:
-                return waitObj
+        waitObjs = self.waitersOfTransaction.get(t)
+        if waitObjs:
+            return next(iter(waitObjs.values()))
         return None
 
+    def _index(self, waitObj):
+        for x in waitObj.variables:
+            self.waitersOnVariable.setdefault(x, {})[waitObj.seq] = waitObj
+        self.waitersOfTransaction.setdefault(waitObj.t, {})[waitObj.seq] = waitObj
+        edges = self.waitsFor.setdefault(waitObj.t, {})
+        for blocker in waitObj.blockedBy:
+            self.waitersOnBlocker.setdefault(blocker, {})[waitObj.seq] = waitObj
+            edges[blocker] = edges.get(blocker, 0) + 1
+
+    def _unindex(self, waitObj):
+        for x in waitObj.variables:
+            self._remove_from_index(self.waitersOnVariable, x, waitObj)
+        self._remove_from_index(self.waitersOfTransaction, waitObj.t, waitObj)
+        edges = self.waitsFor.get(waitObj.t, {})
+        for blocker in waitObj.blockedBy:
+            self._remove_from_index(self.waitersOnBlocker, blocker, waitObj)
+            edges[blocker] -= 1
+            if not edges[blocker]:
+                edges.pop(blocker)
+        if waitObj.t not in self.waitersOfTransaction:
+            self.waitsFor.pop(waitObj.t, None)
+        self.woken.pop(waitObj.seq, None)
+        if waitObj.addedAt is not None:
+            self.metrics.waitTime.record(time.perf_counter() - waitObj.addedAt)
+
+    def _remove_from_index(self, index, key, waitObj):
+        waitObjs = index.get(key)
+        if waitObjs is None:
+            return
+        waitObjs.pop(waitObj.seq, None)
+        if not waitObjs:
+            index.pop(key)
+
     def remove_from_waitList(self, waitObj):
-        if waitObj in self.waitList:
-            self.waitList.remove(waitObj)
+        if self.waitList.get(waitObj.seq) is waitObj:
+            self.waitList.pop(waitObj.seq)
+            self._unindex(waitObj)
     
     # def remove_last_from_waitList(self):
     #     self.waitList.pop()
 
     def remove_waitObj_of_t(self, t):
         """ remove any wait object from transaction t"""
-        for waitObj in list(self.waitList):
-            if waitObj.t == t:
-                self.waitList.remove(waitObj)
+        for waitObj in list(self.waitersOfTransaction.get(t, {}).values()):
+            self.waitList.pop(waitObj.seq)
+            self._unindex(waitObj)
 
-    def add_to_waitList(self, t, op, args, blockedBy):
+    def add_to_waitList(self, t, op, args, blockedBy, tick=None):
         """
         Add transaction to wait list
 
@@ -96,18 +179,90 @@ class WaitList(object):
             List of operation arguments 
         blockedBy: list
             list of transaction object
+        tick: int
+            Current tick
         """
+        # the same operation of t is already waiting
+        for waitObj in self.waitersOfTransaction.get(t, {}).values():
+            if waitObj.operation == (op, args):
+                return
         waitObj = WaitObj(t, op, args, blockedBy)
-        if waitObj in self.waitList:
-            return
-        self.waitList.append(waitObj)
+        waitObj.seq = self.nextSeq
+        waitObj.addedTick = tick
+        self.nextSeq += 1
+        if self.metrics is not None:
+            waitObj.addedAt = time.perf_counter()
+        self.waitList[waitObj.seq] = waitObj
+        self._index(waitObj)
         t.isBlocked = True
-        logger.debug(f"Transaction {t} blocked by {waitObj.blockedBy}, added to wait list. {op}({args})")
+        logger.debug("Transaction %s blocked by %s, added to wait list. %s(%s)", t, waitObj.blockedBy, op, args)
 
         if blockedBy:
-            logger.info(f"Transaction {t.name} blocked by a lock conflict. Locks: {sorted(list(set(blockedBy)))}")
+            logger.info("Transaction %s blocked by a lock conflict. Locks: %s", t.name, sorted(set(blockedBy)))
         else:
-            logger.info(f"Transaction {t.name} blocked because site is down.")
+            logger.info("Transaction %s blocked because site is down.", t.name)
+
+    def wake_variables(self, variables):
+        """
+        Wake up wait objects waiting on any of the given variables.
+
+        Parameters
+        -----------
+        variables: iterable
+            Variable names whose locks, lined up transactions or committed values changed
+        """
+        for x in variables:
+            waitObjs = self.waitersOnVariable.get(x)
+            if waitObjs:
+                self.woken.update(waitObjs)
+
+    def wake_blocked_by(self, t):
+        """
+        Wake up wait objects blocked by transaction t.
+
+        Parameters
+        -----------
+        t: transaction object
+        """
+        self.woken.update(self.waitersOnBlocker.get(t, {}))
+
+    def wake_transaction(self, t):
+        """
+        Wake up wait objects of transaction t, e.g. after t has been marked to abort.
+
+        Parameters
+        -----------
+        t: transaction object
+        """
+        self.woken.update(self.waitersOfTransaction.get(t, {}))
+
+    def has_waiters_on(self, t, variables):
+        """
+        Check if a commit or abort of transaction t, which touched the given variables, would wake up wait objects.
+
+        Parameters
+        -----------
+        t: transaction object
+        variables: iterable
+            Variable names t read, wrote, locked or lined up on
+
+        Return: bool
+        """
+        if not self.waitList:
+            return False
+        return t in self.waitersOnBlocker or any(x in self.waitersOnVariable for x in variables)
+
+    def pop_woken(self):
+        """
+        Get all woken wait objects in their original FIFO order and clear the woken set.
+
+        Return: list
+        -----------
+        List of wait objects that might be executable now.
+        """
+        woken = [self.woken[seq] for seq in sorted(self.woken)]
+        self.woken = {}
+        return woken
 
     # def notify_unblock(self, transaction):
     #     """
@@ -130,49 +285,128 @@ class WaitList(object):
         """
         Deadlock detection
 
+        Find the strongly connected components of the waits-for graph; every component
+        with a cycle loses its youngest transaction (or any transaction waiting for itself), 
+        and the rest of the component is checked again until no cycle is left.
+
         Return list
         -----------
-        If there is a deadlock, return the youngest transaction to abort. 
+        If there are deadlocks, return the youngest transactions to abort. 
         Otherwise, return an empty list.
         """
-        self.visitedWaitObj = []
         youngest = []
-        for waitObj in self.waitList:
-            if waitObj in self.visitedWaitObj:
-                continue
-            self.path = []
-            if self._if_deadlock(waitObj.t, [waitObj.t]):
-                logger.debug(f"Deadlock Detected!")
-                youngest.append(self.get_youngest_transaction())
-                
+        pending = deque([list(self.waitsFor)])
+        while pending:
+            nodes = pending.popleft()
+            for scc in self._get_strongly_connected_components(nodes):
+                # a transaction waiting for itself can only be resolved by aborting it
+                victims = [t for t in scc if t in self.waitsFor.get(t, {})]
+                if not victims and len(scc) > 1:
+                    victims = [self.get_youngest_transaction(scc)]
+                if not victims:
+                    # no cycle
+                    continue
+
+                logger.debug("Deadlock Detected!")
+                youngest += victims
+                # breaking one cycle may leave others in the same component
+                pending.append([t for t in scc if t not in victims])
+
         if not youngest:
-            logger.debug(f"No Deadlock Detected!")
-        return set(youngest)
+            logger.debug("No Deadlock Detected!")
+        return youngest
 
-    def _if_deadlock(self, waitingT, path):
-        waitObj = self.get_waitObj_of_t(waitingT)
-        if not waitObj:
-            # this transaction is not blocked
-            return False
+    def _get_strongly_connected_components(self, nodes):
+        """
+        Iterative Tarjan's algorithm over the waits-for graph restricted to the given nodes.
 
-        self.visitedWaitObj.append(waitObj)
-        for waitFor in waitObj.blockedBy:
-            if waitFor in path:
-                self.path = path
-                return True
+        Parameters
+        -----------
+        nodes: list
+            List of transaction objects
+
+        Return list
+        -----------
+        List of strongly connected components, each one is a list of transaction objects.
+        """
+        allowed = set(nodes)
+        index = {}
+        lowLink = {}
+        onStack = set()
+        stack = []
+        sccs = []
 
-            if self._if_deadlock(waitFor, path+[waitFor]):
-                return True
+        for root in nodes:
+            if root in index:
+                continue
+            index[root] = lowLink[root] = len(index)
+            stack.append(root)
+            onStack.add(root)
+            work = [(root, iter(self.waitsFor.get(root, {})))]
+            while work:
+                node, children = work[-1]
+                descended = False
+                for child in children:
+                    if child not in allowed:
+                        continue
+                    if child not in index:
+                        index[child] = lowLink[child] = len(index)
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append((child, iter(self.waitsFor.get(child, {}))))
+                        descended = True
+                        break
+                    if child in onStack:
+                        lowLink[node] = min(lowLink[node], index[child])
+                if descended:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowLink[parent] = min(lowLink[parent], lowLink[node])
+                if lowLink[node] == index[node]:
+                    scc = []
+                    while True:
+                        t = stack.pop()
+                        onStack.discard(t)
+                        scc.append(t)
+                        if t == node:
+                            break
+                    sccs.append(scc)
+
+        return sccs
+
+    def get_prevention_victims(self, t, blockedBy):
+        """
+        Apply the deadlock prevention policy when transaction t is blocked, using start times only.
+        Wait-die: t dies if it is younger than any transaction blocking it, otherwise it waits.
+        Wound-wait: t wounds (aborts) the blocking transactions younger than it, and waits for the others.
 
-        return False          
+        Parameters
+        -----------
+        t: transaction object
+        blockedBy: list
+            list of transaction object
+
+        Return list
+        -----------
+        Transactions to abort; empty if t just waits, or under deadlock detection.
+        """
+        blockers = [blocker for blocker in dict.fromkeys(blockedBy) if blocker != t]
+        if self.deadlockPolicy == DeadlockPolicy.WAIT_DIE:
+            return [t] if any(blocker.startTime < t.startTime for blocker in blockers) else []
+        if self.deadlockPolicy == DeadlockPolicy.WOUND_WAIT:
+            return [blocker for blocker in blockers if blocker.startTime > t.startTime]
+        return []
 
-    def get_youngest_transaction(self):
+    def get_youngest_transaction(self, transactions):
         maxTime = -1
         youngest = None
-        for t in self.path:
+        for t in transactions:
              if t.startTime > maxTime:
                 maxTime = t.startTime
                 youngest = t
 
-        logger.debug(f"Youngest transaction: {youngest}")
+        logger.debug("Youngest transaction: %s", youngest)
         return youngest
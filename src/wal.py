@@ -0,0 +1,142 @@
+"""
+Script that contains the write-ahead log and checkpoints of a site, used in durable mode.
+
+Each site appends a fixed-size binary record per committed write to its WAL and fsyncs
+once per commit tick. Every `checkpointInterval` records, the committed values are written
+to a checkpoint file and the WAL is truncated, so a restart only maps the checkpoint and
+replays the records written since.
+
+@Author: Tanran Zheng (tz408@nyu.edu) and Daria Xu (xx2085@nyu.edu).
+@Date: Dec/03/2022
+@Instructor: Prof. Dennis Shasha
+
+"""
+
+from array import array
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+# WAL record: commit tick, variable slot, committed value
+WAL_RECORD = struct.Struct('<qqq')
+# checkpoint header: magic, number of slots; followed by the values as int64
+CHECKPOINT_HEADER = struct.Struct('<4sq')
+CHECKPOINT_MAGIC = b'RCCK'
+
+class SiteLog(object):
+    def __init__(self, directory, siteName, checkpointInterval=1000) -> None:
+        """
+        Initialize SiteLog.
+
+        Parameters
+        -----------
+        directory: str
+            Directory of the WAL and checkpoint files
+        siteName: str
+            Site name
+        checkpointInterval: int
+            Number of WAL records after which a checkpoint is written
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.walPath = os.path.join(directory, f"site{siteName}.wal")
+        self.checkpointPath = os.path.join(directory, f"site{siteName}.ckpt")
+        self.checkpointInterval = checkpointInterval
+        # records appended but not synced yet, and records since the last checkpoint
+        self.buffer = bytearray()
+        self.numOfRecords = 0
+        self.wal = None
+
+    def restore(self, numOfSlots):
+        """
+        Load the committed values from the checkpoint and replay the WAL.
+
+        Parameters
+        -----------
+        numOfSlots: int
+            Number of variables stored on the site
+
+        Returns: array
+        -----------
+        Committed values by slot; None if nothing was logged before.
+        """
+        if not os.path.exists(self.checkpointPath):
+            return None
+
+        with open(self.checkpointPath, 'rb') as checkpoint:
+            with mmap.mmap(checkpoint.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, n = CHECKPOINT_HEADER.unpack_from(mm, 0)
+                if magic != CHECKPOINT_MAGIC or n != numOfSlots:
+                    raise ValueError(f"{self.checkpointPath} is not a checkpoint of a site with {numOfSlots} variables!")
+                values = array('q')
+                values.frombytes(mm[CHECKPOINT_HEADER.size:CHECKPOINT_HEADER.size + 8*n])
+
+        numOfRecords = 0
+        if os.path.exists(self.walPath):
+            with open(self.walPath, 'rb') as wal:
+                data = wal.read()
+            # drop a torn record at the tail
+            end = len(data) - len(data) % WAL_RECORD.size
+            for _, slot, value in WAL_RECORD.iter_unpack(memoryview(data)[:end]):
+                values[slot] = value
+            numOfRecords = end // WAL_RECORD.size
+            if end != len(data):
+                with open(self.walPath, 'r+b') as wal:
+                    wal.truncate(end)
+
+        self.numOfRecords = numOfRecords
+        logger.debug("%s: restored %s values, replayed %s WAL records", self.walPath, numOfSlots, numOfRecords)
+        return values
+
+    def append(self, tick, slot, value):
+        """ Buffer a commit record, written by the next `sync`. """
+        self.buffer += WAL_RECORD.pack(tick, slot, value)
+
+    def sync(self):
+        """
+        Write the buffered records and fsync the WAL once for all of them.
+
+        Returns: bool
+        -----------
+        True if a checkpoint is due.
+        """
+        if not self.buffer:
+            return False
+        if self.wal is None:
+            self.wal = open(self.walPath, 'ab')
+        self.wal.write(self.buffer)
+        self.wal.flush()
+        os.fsync(self.wal.fileno())
+        self.numOfRecords += len(self.buffer) // WAL_RECORD.size
+        self.buffer = bytearray()
+        return self.numOfRecords >= self.checkpointInterval
+
+    def checkpoint(self, values):
+        """
+        Write a checkpoint of the committed values and truncate the WAL.
+
+        Parameters
+        -----------
+        values: array
+            Committed values by slot
+        """
+        tmpPath = self.checkpointPath + ".tmp"
+        with open(tmpPath, 'wb') as checkpoint:
+            checkpoint.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, len(values)))
+            checkpoint.write(values.tobytes())
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(tmpPath, self.checkpointPath)
+
+        # the checkpoint covers every record written so far
+        if self.wal is not None:
+            self.wal.close()
+        self.wal = open(self.walPath, 'wb')
+        self.numOfRecords = 0
+
+    def close(self):
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
@@ -1,38 +1,200 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
 import os
+import shlex
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 # NOTE: modify this if tests cases are stored in path different that pwd
 TEST_FOLDER = "./tests"
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# a test file with this line is sent to the server, one operation at a time
+SERVER_DIRECTIVE = "// server"
+# in a server test, the following lines are sent by the client with this name (connected on first use),
+# and a disconnect line closes the connection of the current client
+CLIENT_DIRECTIVE = "// client"
+DISCONNECT_DIRECTIVE = "// disconnect"
+# lines starting with this give the command line options of main.py to run a test file with,
+# `{tmpDir}` in them is replaced by a temporary directory kept for the whole test file
+OPTIONS_DIRECTIVE = "// options:"
+# this line ends a run, the following lines are run again from a new data manager with their own options
+RESTART_DIRECTIVE = "// restart"
+# metrics with deterministic values, printed after the output of a run with --metrics; dots separate nested keys
+METRICS_IN_OUTPUT = ["waitListRescans", "waitListRetries", "deadlockDetection.count", "deadlockDetection.victims",
+                     "deadlockDetection.maxDelayTicks", "peakLockTableSize", "abortReasons", "readsPerSite",
+                     "retainedVersions", "peakRetainedVersions"]
 
-def cmp_file(filename1, filename2):
-    if open(filename1,'r').read() == open(filename2,'r').read():
-        return True
-    return False
+def init_worker():
+    """ Make the engine importable and send its output to an in-memory sink. """
+    sys.path.insert(0, SRC_FOLDER)
+    from main import SpecialFormatter
+    global outputSink
+    outputSink = logging.StreamHandler(io.StringIO())
+    # the output file of main.py only has records from INFO on
+    outputSink.setLevel(logging.INFO)
+    outputSink.setFormatter(SpecialFormatter())
+    logging.basicConfig(level=logging.INFO, handlers=[outputSink])
+
+async def drive_server(server, lines):
+    """
+    Serve on a Unix socket and send the lines of a server test, from one client unless the test names others.
+
+    Returns: str
+    -----------
+    Transcript of the sent lines (prefixed with `<client>> `), the client directives and the replies.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "repcrec.sock")
+        serving = asyncio.create_task(server.serve(unixSocket=path))
+        while not os.path.exists(path):
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.01)
+        # client name -> (reader, writer)
+        clients = {}
+        client = ""
+        transcript = []
+        for line in lines:
+            if line.startswith(CLIENT_DIRECTIVE):
+                client = line[len(CLIENT_DIRECTIVE):].strip()
+                transcript.append(line)
+                continue
+            if line == DISCONNECT_DIRECTIVE:
+                transcript.append(line)
+                numOfSessions = len(server.sessions)
+                _, writer = clients.pop(client)
+                writer.close()
+                await writer.wait_closed()
+                # the server aborts the transactions of the client before the next line is sent
+                while len(server.sessions) >= numOfSessions:
+                    await asyncio.sleep(0.01)
+                continue
+            if client not in clients:
+                clients[client] = await asyncio.open_unix_connection(path)
+                while len(server.sessions) < len(clients):
+                    await asyncio.sleep(0.01)
+            reader, writer = clients[client]
+            transcript.append(f"{client}> {line}")
+            writer.write((line + "\n").encode())
+            # the replies of an operation end with its status line
+            while not transcript[-1].startswith("# "):
+                reply = await asyncio.wait_for(reader.readline(), timeout=5)
+                transcript.append(reply.decode().rstrip("\n"))
+        for _, writer in clients.values():
+            writer.close()
+            await writer.wait_closed()
+        serving.cancel()
+    return "\n".join(transcript) + "\n"
+
+def format_metrics(path):
+    """ Format the deterministic metrics of the JSON file exported by a run, one per line. """
+    with open(path) as f:
+        metrics = json.load(f)
+    lines = []
+    for key in METRICS_IN_OUTPUT:
+        value = metrics
+        for part in key.split("."):
+            value = value[part]
+        lines.append(f"metrics {key}: {json.dumps(value)}\n")
+    return "".join(lines)
+
+def run_test(testFile):
+    """
+    Run a test in-process.
+
+    Parameters
+    -----------
+    testFile: str
+        Path to test file
+
+    Returns: tuple
+    -----------
+    (output, error message or None, elapsed seconds)
+    """
+    from main import create_managers, parse_args, parse_lines, run, save_results
+    from server import RepCRecServer
+
+    with open(testFile) as f:
+        lines = [line.strip() for line in f]
+    runs = [[]]
+    for line in lines:
+        if line == RESTART_DIRECTIVE:
+            runs.append([])
+        else:
+            runs[-1].append(line)
+
+    output = []
+    start = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for runLines in runs:
+                outputSink.setStream(io.StringIO())
+                options = " ".join(line[len(OPTIONS_DIRECTIVE):] for line in runLines if line.startswith(OPTIONS_DIRECTIVE))
+                args, detectionTrigger = parse_args(shlex.split(options.replace("{tmpDir}", tmpDir)))
+                logging.getLogger().setLevel(max(logging.INFO, logging.getLevelName(args.logLevel)))
+                DM, TM = create_managers(args)
+                try:
+                    if SERVER_DIRECTIVE in runLines:
+                        operations = [line for line in runLines if line and (not line.startswith("//") 
+                                      or line.startswith(CLIENT_DIRECTIVE) or line == DISCONNECT_DIRECTIVE)]
+                        output.append(asyncio.run(drive_server(RepCRecServer(DM, TM, detectionTrigger), operations)))
+                        save_results(args, DM, TM)
+                    else:
+                        run(parse_lines(runLines), DM, TM, detectionTrigger)
+                        save_results(args, DM, TM)
+                        output.append(outputSink.stream.getvalue())
+                    if args.metrics:
+                        output.append(format_metrics(args.metrics))
+                finally:
+                    DM.close()
+    except Exception as e:
+        output.append(outputSink.stream.getvalue())
+        return "".join(output), repr(e), time.perf_counter() - start
+    return "".join(output), None, time.perf_counter() - start
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run all test cases and compare them to the expected outputs.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes.')
+    parser.add_argument('--timing', action='store_true', help='Print the run time of each test, slowest first.')
+    args = parser.parse_args()
+
     # test file name format: `test<unique_numerical_number>.txt`
-    numOfTest = [f[4:-4] for f in os.listdir(TEST_FOLDER) if f.startswith('test') and f.endswith('.txt')]
+    numOfTest = sorted([f[4:-4] for f in os.listdir(TEST_FOLDER) if f.startswith('test') and f.endswith('.txt')],
+                       key=lambda n: (len(n), n))
+    testFiles = [os.path.join("tests", f"test{str(test)}.txt") for test in numOfTest]
 
     num_of_correct = 0
-    for test in tqdm(numOfTest, desc='Running tests '):
-        testFile = os.path.join("tests", f"test{str(test)}.txt")
-        execution = f"python3 {os.path.join('src', 'main.py')} --testFile {testFile}"
-        cmd = os.system(execution)
-        if cmd != 0:
-            print(f"{testFile} Failed!!!!")
-        else:
+    timing = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        results = executor.map(run_test, testFiles, chunksize=max(len(testFiles) // (4 * args.workers), 1))
+        for test, testFile, (output, error, elapsed) in tqdm(zip(numOfTest, testFiles, results), total=len(testFiles), desc='Running tests '):
+            timing[testFile] = elapsed
             outFile = os.path.join('output', f'test{str(test)}.out')
             correctOut = os.path.join("tests", "correct_output", f"test{str(test)}.out")
-            if not os.path.exists(outFile):
-                print(f"{outFile} is not exist!!!")
+            if error is not None:
+                print(f"{testFile} Failed!!!! {error}")
                 continue
             if not os.path.exists(correctOut):
                 print(f"Correct output {correctOut} is not exist!!!")
                 continue
-            if not cmp_file(outFile, correctOut):
+            if output != open(correctOut, 'r').read():
+                # keep the wrong output for inspection
+                os.makedirs('output', exist_ok=True)
+                with open(outFile, 'w') as out:
+                    out.write(output)
                 print(f"{outFile} is not correct!!!")
             else:
                 num_of_correct += 1
-                
-    print(f"Number of correct test case: {num_of_correct} out of {len(numOfTest)}.")
 
-            
\ No newline at end of file
+    if args.timing:
+        for testFile, elapsed in sorted(timing.items(), key=lambda item: -item[1]):
+            print(f"{testFile:<24} {elapsed*1000:>10.2f} ms")
+        print(f"Total: {time.perf_counter() - start:.2f}s with {args.workers} workers")
+
+    print(f"Number of correct test case: {num_of_correct} out of {len(numOfTest)}.")